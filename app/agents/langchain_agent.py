@@ -1,24 +1,53 @@
 
 """
 This file defines:
-- The LLM (Ollama - local LLM with native tool calling)
+- The LLM (routed across Ollama / OpenAI-compatible backends, see llm_router.py)
 - Descriptions of tools (used by the agent)
+- The system prompt (full and compact variants)
+- reply_after_writes: sends the confirmation after a turn's writes to the light tier
 - A helper to create an agent with tools
 """
 
 from dotenv import load_dotenv
+import json
 import os
-from langchain_ollama import ChatOllama
 from langchain.agents import create_agent
+from langchain.agents.middleware import wrap_model_call
+from langchain_core.messages import ToolMessage
 from langgraph.checkpoint.memory import MemorySaver
+from app.agents.llm_router import LIGHT_TIER, LLMRouter, RoutedChatModel, load_backends
 
 load_dotenv()
 
-llm = ChatOllama(
-    model="llama3.1",
-    temperature=0
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+OLLAMA_LIGHT_MODEL = os.getenv("OLLAMA_LIGHT_MODEL")
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+PROMPT_VARIANT = os.getenv("AGENT_PROMPT_VARIANT", "full")
+
+# Ollama reuses the evaluated KV cache for the longest common prompt prefix,
+# but only while the model stays loaded with the same options. Every request
+# (including the warm-up) must therefore send identical options.
+OLLAMA_OPTIONS = {"num_ctx": OLLAMA_NUM_CTX, "temperature": 0}
+
+llm_router = LLMRouter(
+    load_backends(
+        os.getenv("LLM_BACKENDS"),
+        ollama_defaults={
+            "model": OLLAMA_MODEL,
+            "base_url": OLLAMA_BASE_URL,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "num_ctx": OLLAMA_NUM_CTX,
+            "timeout": LLM_TIMEOUT_SECONDS,
+        },
+        light_model=OLLAMA_LIGHT_MODEL,
+    )
 )
 
+llm = RoutedChatModel(router=llm_router)
+
 TOOL_DESCRIPTIONS = {
     "create_registration":
         "Creates a new user registration. "
@@ -38,6 +67,11 @@ TOOL_DESCRIPTIONS = {
         "Input: Either a UUID string or an email address. "
         "Returns user information in JSON format.",
 
+    "search_registrations":
+        "Finds users by part of their name, email or phone number. "
+        "Input: a search string such as 'Alice Smith', 'alice@' or '5551234'. "
+        "Returns the best matches (id, name, email, phone), best first.",
+
     "update_registration":
         "Updates an existing user registration. "
         "Input: {\"id\": \"UUID\", \"updates\": {\"field\": \"value\"}}. "
@@ -48,74 +82,144 @@ TOOL_DESCRIPTIONS = {
         "Input: Either a UUID string or email address of the user to delete.",
 }
 
+SYSTEM_PROMPT = (
+    "You are a helpful assistant that manages user registrations.\n\n"
+
+    "🚨 CRITICAL RULES 🚨\n"
+    "1. ONLY call create_registration when you have ALL required parameters: full_name, email, phone, date_of_birth, and address.\n"
+    "2. If you are missing ANY required parameter, respond conversationally asking for it. DO NOT attempt to call the tool.\n"
+    "3. NEVER make up or assume parameter values.\n"
+    "4. NEVER use example/default values like 'John Doe', 'john.doe@example.com', or '1234567890'.\n"
+    "5. DO NOT output JSON tool calls in your response text - either call the tool properly or ask conversationally.\n"
+    "6. ⚠️ NEVER claim you have information that the user hasn't explicitly provided. Only acknowledge information that was actually given.\n\n"
+
+    "REQUIRED PARAMETERS FOR create_registration:\n"
+    "- full_name (required)\n"
+    "- email (required)\n"
+    "- phone (required)\n"
+    "- date_of_birth (required, format: YYYY-MM-DD)\n"
+    "- address (optional, but ask for it)\n\n"
+
+    "CORRECT BEHAVIOR EXAMPLES:\n\n"
+    
+    "Example 1 - User provides nothing:\n"
+    "User: 'I want to register a new user'\n"
+    "You: 'I'd be happy to help you register! To create a new user account, I'll need the following information:\n"
+    "      - Full name\n"
+    "      - Email address\n"
+    "      - Phone number\n"
+    "      - Date of birth (YYYY-MM-DD format)\n"
+    "      - Address\n"
+    "      Please provide these details.'\n\n"
+    
+    "Example 2 - User provides some info:\n"
+    "User: 'Register Anu, email Anu@gmail.com, phone 9989898989'\n"
+    "You: 'Great! I have:\n"
+    "      ✓ Name: Anu\n"
+    "      ✓ Email: Anu@gmail.com\n"
+    "      ✓ Phone: 9989898989\n\n"
+    "      I still need:\n"
+    "      - Date of birth (YYYY-MM-DD format)\n"
+    "      - Address\n"
+    "      Please provide these to complete the registration.'\n\n"
+    
+    "Example 3 - User provides all info:\n"
+    "User: 'Name: Alice Smith, email: alice@test.com, phone: 555-1234, DOB: 1990-05-15, address: 123 Main St'\n"
+    "You: [Call create_registration tool with all parameters]\n\n"
+
+    "INCORRECT BEHAVIOR (DO NOT DO THIS):\n"
+    "❌ User: 'I want to register'\n"
+    "❌ You: 'I have the email and phone...' (NO! User didn't provide these!)\n\n"
+    "❌ You: 'I need more info. {\"name\": \"create_registration\", ...}' (NO! Don't show JSON!)\n\n"
+
+    "FINDING USERS:\n"
+    "- If the user names a person but gives no exact email or ID, call search_registrations with the name (or partial email/phone) instead of asking for the ID\n"
+    "- If several users match, list them briefly and ask which one is meant\n\n"
+
+    "ERROR HANDLING:\n"
+    "- When a tool returns an error starting with 'TELL THE USER:', use that EXACT text in your response\n"
+    "- DO NOT paraphrase or modify the error message\n"
+    "- If email already exists, ask for a different email\n"
+    "- Be patient and helpful\n\n"
+
+    "Remember: Only acknowledge information the user has ACTUALLY provided. Never claim to have data you don't have."
+)
+
+SYSTEM_PROMPT_COMPACT = (
+    "You manage user registrations with the provided tools.\n"
+    "Rules:\n"
+    "1. Call create_registration only when the user gave full_name, email, phone and "
+    "date_of_birth (YYYY-MM-DD); ask for address too. Otherwise ask for what is missing.\n"
+    "2. Never invent values or use placeholders like 'John Doe', 'john.doe@example.com', '1234567890'.\n"
+    "3. Only acknowledge information the user actually provided.\n"
+    "4. Never write tool-call JSON in your reply; call the tool or answer in plain text.\n"
+    "5. If a tool error starts with 'TELL THE USER:', repeat that text exactly.\n"
+    "6. If the email already exists, ask for a different one.\n"
+    "7. To find a user from a name or partial email/phone, call search_registrations."
+)
+
+SYSTEM_PROMPTS = {
+    "full": SYSTEM_PROMPT,
+    "compact": SYSTEM_PROMPT_COMPACT,
+}
+
+
+def get_system_prompt(variant: str = PROMPT_VARIANT) -> str:
+    """
+    Returns the static system prompt. It must stay byte-identical between
+    turns and sessions so Ollama can reuse the evaluated prefix.
+    """
+    return SYSTEM_PROMPTS.get(variant, SYSTEM_PROMPT)
+
+
+# Once these succeed, what the user asked for is done and the next step
+# only has to confirm it.
+WRITE_TOOLS = {"create_registration", "update_registration", "delete_registration"}
+
+
+def _write_succeeded(message) -> bool:
+    if not isinstance(message, ToolMessage) or message.name not in WRITE_TOOLS or message.status != "success":
+        return False
+    try:
+        return "error" not in json.loads(message.content)
+    except (TypeError, ValueError):
+        return False
+
+
+@wrap_model_call
+def reply_after_writes(request, handler):
+    """
+    When every tool result of the last step is a successful write, the
+    model is called without tools, which pick_tier sends to the light tier.
+    Only done when the router has a light backend: dropping the tool
+    schemas changes the prompt prefix the default model keeps cached.
+    """
+    model = request.model
+    if isinstance(model, RoutedChatModel) and model.router.has_tier(LIGHT_TIER):
+        results = []
+        for message in reversed(request.messages):
+            if not isinstance(message, ToolMessage):
+                break
+            results.append(message)
+        if results and all(map(_write_succeeded, results)):
+            request = request.override(tools=[], tool_choice=None)
+    return handler(request)
+
+
 # Create a single shared memory saver instance
 memory = MemorySaver()
 
-def create_agent_with_tools(tools: list):
+def create_agent_with_tools(tools: list, model=None):
     """
     Creates a LangChain agent that can use the provided tools.
+    The system prompt and the tool schemas form the static prompt prefix,
+    so `tools` must always be passed in the same order.
     """
     agent = create_agent(
-        model=llm,
+        model=model or llm,
         tools=tools,
         checkpointer=memory,
-        system_prompt=(
-            "You are a helpful assistant that manages user registrations.\n\n"
-
-            "🚨 CRITICAL RULES 🚨\n"
-            "1. ONLY call create_registration when you have ALL required parameters: full_name, email, phone, date_of_birth, and address.\n"
-            "2. If you are missing ANY required parameter, respond conversationally asking for it. DO NOT attempt to call the tool.\n"
-            "3. NEVER make up or assume parameter values.\n"
-            "4. NEVER use example/default values like 'John Doe', 'john.doe@example.com', or '1234567890'.\n"
-            "5. DO NOT output JSON tool calls in your response text - either call the tool properly or ask conversationally.\n"
-            "6. ⚠️ NEVER claim you have information that the user hasn't explicitly provided. Only acknowledge information that was actually given.\n\n"
-
-            "REQUIRED PARAMETERS FOR create_registration:\n"
-            "- full_name (required)\n"
-            "- email (required)\n"
-            "- phone (required)\n"
-            "- date_of_birth (required, format: YYYY-MM-DD)\n"
-            "- address (optional, but ask for it)\n\n"
-
-            "CORRECT BEHAVIOR EXAMPLES:\n\n"
-            
-            "Example 1 - User provides nothing:\n"
-            "User: 'I want to register a new user'\n"
-            "You: 'I'd be happy to help you register! To create a new user account, I'll need the following information:\n"
-            "      - Full name\n"
-            "      - Email address\n"
-            "      - Phone number\n"
-            "      - Date of birth (YYYY-MM-DD format)\n"
-            "      - Address\n"
-            "      Please provide these details.'\n\n"
-            
-            "Example 2 - User provides some info:\n"
-            "User: 'Register Anu, email Anu@gmail.com, phone 9989898989'\n"
-            "You: 'Great! I have:\n"
-            "      ✓ Name: Anu\n"
-            "      ✓ Email: Anu@gmail.com\n"
-            "      ✓ Phone: 9989898989\n\n"
-            "      I still need:\n"
-            "      - Date of birth (YYYY-MM-DD format)\n"
-            "      - Address\n"
-            "      Please provide these to complete the registration.'\n\n"
-            
-            "Example 3 - User provides all info:\n"
-            "User: 'Name: Alice Smith, email: alice@test.com, phone: 555-1234, DOB: 1990-05-15, address: 123 Main St'\n"
-            "You: [Call create_registration tool with all parameters]\n\n"
-
-            "INCORRECT BEHAVIOR (DO NOT DO THIS):\n"
-            "❌ User: 'I want to register'\n"
-            "❌ You: 'I have the email and phone...' (NO! User didn't provide these!)\n\n"
-            "❌ You: 'I need more info. {\"name\": \"create_registration\", ...}' (NO! Don't show JSON!)\n\n"
-
-            "ERROR HANDLING:\n"
-            "- When a tool returns an error starting with 'TELL THE USER:', use that EXACT text in your response\n"
-            "- DO NOT paraphrase or modify the error message\n"
-            "- If email already exists, ask for a different email\n"
-            "- Be patient and helpful\n\n"
-
-            "Remember: Only acknowledge information the user has ACTUALLY provided. Never claim to have data you don't have."
-        )
+        system_prompt=get_system_prompt(),
+        middleware=[reply_after_writes],
     )
     return agent
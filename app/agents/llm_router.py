@@ -0,0 +1,247 @@
+
+"""
+This file defines:
+- LLMBackend: one chat model endpoint (an Ollama host/model or an OpenAI-compatible API)
+- LLMRouter: picks a backend by observed latency and queue depth
+- RoutedChatModel: a chat model that sends each call through the router
+  and fails over to the next backend on timeouts and errors
+- load_backends: builds the backend list from LLM_BACKENDS or the Ollama defaults
+"""
+
+import json
+import os
+import time
+from threading import Lock
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_ollama import ChatOllama
+from langchain_openai import ChatOpenAI
+from pydantic import Field
+
+from app.agents.run_budget import BudgetExceeded
+from app.utils.metrics import metrics
+
+DEFAULT_TIER = "default"
+LIGHT_TIER = "light"
+
+
+class LLMBackend:
+    def __init__(
+        self,
+        name: str,
+        model: BaseChatModel,
+        provider: str = "ollama",
+        model_name: str = "",
+        base_url: str = "",
+        tier: str = DEFAULT_TIER,
+        keep_alive: str | None = None,
+        num_ctx: int | None = None,
+    ):
+        self.name = name
+        self.model = model
+        self.provider = provider
+        self.model_name = model_name
+        self.base_url = base_url
+        self.tier = tier
+        # Ollama only: what the warmer must send to load the same model instance.
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+
+        self.ewma_latency = None
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def score(self) -> float:
+        """
+        Expected wait for a new call: smoothed latency scaled by the number
+        of calls already queued on this backend. Unmeasured backends score 0
+        so they get probed.
+        """
+        return (self.ewma_latency or 0.0) * (1 + self.in_flight)
+
+
+class LLMRouter:
+    def __init__(self, backends: list[LLMBackend], alpha: float = 0.3, cooldown_seconds: float = 30):
+        if not any(b.tier != LIGHT_TIER for b in backends):
+            raise ValueError("LLMRouter needs at least one backend outside the light tier")
+        self.backends = backends
+        self.alpha = alpha
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = Lock()
+
+    def has_tier(self, tier: str) -> bool:
+        return any(b.tier == tier for b in self.backends)
+
+    def candidates(self, tier: str = DEFAULT_TIER, tools_bound: bool = False) -> list[LLMBackend]:
+        """
+        Backends to try, in order: healthy backends of the requested tier
+        by score, then the other tier, then backends still cooling down.
+        Calls with tools bound never go to a light backend, not even when
+        every other one is cooling down.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return sorted(
+                (b for b in self.backends if not (tools_bound and b.tier == LIGHT_TIER)),
+                key=lambda b: (b.cooldown_until > now, b.tier != tier, b.score()),
+            )
+
+    def acquire(self, backend: LLMBackend):
+        with self._lock:
+            backend.in_flight += 1
+            metrics.set_gauge("llm_backend_in_flight", backend.in_flight, backend=backend.name)
+
+    def abandon(self, backend: LLMBackend):
+        """Releases a call that was stopped by the caller, not by the backend."""
+        with self._lock:
+            backend.in_flight -= 1
+            metrics.set_gauge("llm_backend_in_flight", backend.in_flight, backend=backend.name)
+
+    def release(self, backend: LLMBackend, elapsed: float, ok: bool):
+        with self._lock:
+            backend.in_flight -= 1
+            metrics.set_gauge("llm_backend_in_flight", backend.in_flight, backend=backend.name)
+            if ok:
+                backend.failures = 0
+                backend.cooldown_until = 0.0
+                if backend.ewma_latency is None:
+                    backend.ewma_latency = elapsed
+                else:
+                    backend.ewma_latency = self.alpha * elapsed + (1 - self.alpha) * backend.ewma_latency
+            else:
+                backend.failures += 1
+                backend.cooldown_until = time.monotonic() + self.cooldown_seconds
+        if ok:
+            metrics.observe("llm_backend_latency_seconds", elapsed, backend=backend.name)
+        else:
+            metrics.incr("llm_backend_failures_total", backend=backend.name)
+
+
+def pick_tier(messages: list, tools: list) -> str:
+    """
+    A call that follows a tool result and can't call tools only has to
+    turn that result into a reply, so it goes to the light tier (the agent
+    makes such calls once a turn's writes succeeded, see
+    langchain_agent.reply_after_writes). A call with tools bound may have
+    to make the next tool call (e.g. an update after a lookup), so it stays
+    on the default tier like everything else.
+    """
+    if not tools and messages and isinstance(messages[-1], ToolMessage):
+        return LIGHT_TIER
+    return DEFAULT_TIER
+
+
+class RoutedChatModel(BaseChatModel):
+    router: Any = Field(exclude=True)
+    tools: list = Field(default_factory=list)
+    tool_kwargs: dict = Field(default_factory=dict)
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed"
+
+    def bind_tools(self, tools, *, tool_choice=None, **kwargs):
+        if tool_choice is not None:
+            kwargs["tool_choice"] = tool_choice
+        return self.model_copy(update={"tools": list(tools), "tool_kwargs": kwargs})
+
+    def _bound(self, backend: LLMBackend):
+        if not self.tools:
+            return backend.model
+        return backend.model.bind_tools(self.tools, **self.tool_kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        tier = pick_tier(messages, self.tools)
+        last_error = None
+
+        for attempt, backend in enumerate(self.router.candidates(tier, tools_bound=bool(self.tools))):
+            if attempt:
+                metrics.incr("llm_failovers_total", tier=tier)
+            self.router.acquire(backend)
+            start = time.perf_counter()
+            try:
+                message = self._bound(backend).invoke(messages, stop=stop, **kwargs)
+            except BudgetExceeded:
+                # The run was stopped; the backend is fine.
+                self.router.abandon(backend)
+                raise
+            except Exception as e:
+                self.router.release(backend, time.perf_counter() - start, ok=False)
+                print(f"[ERROR] LLM backend {backend.name} failed: {e}")
+                last_error = e
+                continue
+
+            self.router.release(backend, time.perf_counter() - start, ok=True)
+            message.response_metadata["backend"] = backend.name
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        raise last_error
+
+
+def make_backend(spec: dict, ollama_defaults: dict | None = None) -> LLMBackend:
+    """
+    Builds a backend from a spec like
+    {"name": "gpu-1", "provider": "ollama", "model": "llama3.1",
+     "base_url": "http://gpu-1:11434", "tier": "default", "timeout": 60}.
+    Use "provider": "openai" for OpenAI-compatible endpoints; the API key
+    is read from the env var named by "api_key_env" (default OPENAI_API_KEY).
+    """
+    defaults = ollama_defaults or {}
+    provider = spec.get("provider", "ollama")
+    model_name = spec["model"]
+    timeout = float(spec.get("timeout", defaults.get("timeout", 120)))
+
+    keep_alive = num_ctx = None
+    if provider == "ollama":
+        base_url = spec.get("base_url", defaults.get("base_url", "http://localhost:11434"))
+        keep_alive = spec.get("keep_alive", defaults.get("keep_alive"))
+        num_ctx = spec.get("num_ctx", defaults.get("num_ctx"))
+        model = ChatOllama(
+            model=model_name,
+            base_url=base_url,
+            keep_alive=keep_alive,
+            num_ctx=num_ctx,
+            temperature=0,
+            client_kwargs={"timeout": timeout},
+        )
+    elif provider == "openai":
+        base_url = spec.get("base_url", "https://api.openai.com/v1")
+        model = ChatOpenAI(
+            model=model_name,
+            base_url=base_url,
+            api_key=os.getenv(spec.get("api_key_env", "OPENAI_API_KEY"), "not-needed"),
+            temperature=0,
+            timeout=timeout,
+            max_retries=0,
+        )
+    else:
+        raise ValueError(f"Unknown LLM provider: {provider}")
+
+    return LLMBackend(
+        name=spec.get("name", f"{provider}:{model_name}@{base_url}"),
+        model=model,
+        provider=provider,
+        model_name=model_name,
+        base_url=base_url,
+        tier=spec.get("tier", DEFAULT_TIER),
+        keep_alive=keep_alive,
+        num_ctx=num_ctx,
+    )
+
+
+def load_backends(raw: str | None, ollama_defaults: dict, light_model: str | None = None) -> list[LLMBackend]:
+    """
+    Parses the LLM_BACKENDS JSON list. Without it, a single Ollama backend
+    is built from the defaults, plus a light-tier one when light_model is set.
+    """
+    if raw:
+        specs = json.loads(raw)
+    else:
+        specs = [{"name": "ollama", "model": ollama_defaults["model"]}]
+        if light_model:
+            specs.append({"name": "ollama-light", "model": light_model, "tier": LIGHT_TIER})
+    return [make_backend(spec, ollama_defaults) for spec in specs]
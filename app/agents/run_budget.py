@@ -0,0 +1,142 @@
+
+"""
+This file defines:
+- RunBudget: per-request limits for an agent run (deadline, model steps,
+  tool calls) enforced from LangChain callbacks, plus cooperative cancellation
+- run_agent: runs a blocking agent call in a worker thread and cancels it
+  when the deadline passes or the HTTP client disconnects
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+AGENT_DEADLINE_SECONDS = float(os.getenv("AGENT_DEADLINE_SECONDS", "60"))
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "8"))
+AGENT_MAX_TOOL_CALLS = int(os.getenv("AGENT_MAX_TOOL_CALLS", "6"))
+AGENT_CANCEL_GRACE_SECONDS = float(os.getenv("AGENT_CANCEL_GRACE_SECONDS", "2"))
+
+POLL_SECONDS = 0.05
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(f"Agent run stopped: {reason}")
+        self.reason = reason
+
+
+class RunBudget(BaseCallbackHandler):
+    """
+    Callback handler that raises BudgetExceeded before the next model or
+    tool call once the run is over budget or has been cancelled. The agent
+    graph only checks between steps, so an in-flight model call finishes
+    (or times out) before the run stops.
+    """
+
+    raise_error = True
+
+    def __init__(
+        self,
+        deadline_seconds: float = AGENT_DEADLINE_SECONDS,
+        max_steps: int = AGENT_MAX_STEPS,
+        max_tool_calls: int = AGENT_MAX_TOOL_CALLS,
+    ):
+        self.deadline = time.monotonic() + deadline_seconds
+        self.max_steps = max_steps
+        self.max_tool_calls = max_tool_calls
+        self.steps = 0
+        self.tool_calls = 0
+        self.cancel_reason = None
+        self._cancelled = threading.Event()
+        self._open_model_runs = set()
+
+    @property
+    def recursion_limit(self) -> int:
+        # Each step is a model node plus a tools node; keep LangGraph's own
+        # limit above ours so RunBudget reports the reason.
+        return 2 * (self.max_steps + 1) + 1
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def cancel(self, reason: str):
+        if not self._cancelled.is_set():
+            self.cancel_reason = reason
+            self._cancelled.set()
+
+    def check(self):
+        if self.cancelled:
+            raise BudgetExceeded(self.cancel_reason)
+        if self.expired():
+            self.cancel("deadline")
+            raise BudgetExceeded("deadline")
+
+    def _model_step(self, run_id):
+        # A model that delegates to another one (RoutedChatModel calling a
+        # backend) starts a second model run inside the first. The agent
+        # calls its model one step at a time, so count only the outer run.
+        if self._open_model_runs:
+            self._open_model_runs.add(run_id)
+            return
+        self.check()
+        self.steps += 1
+        if self.steps > self.max_steps:
+            self.cancel("steps")
+            raise BudgetExceeded("steps")
+        self._open_model_runs.add(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._model_step(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._model_step(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._open_model_runs.discard(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._open_model_runs.discard(run_id)
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.check()
+        self.tool_calls += 1
+        if self.tool_calls > self.max_tool_calls:
+            self.cancel("tool_calls")
+            raise BudgetExceeded("tool_calls")
+
+
+async def run_agent(fn, budget: RunBudget, request=None, grace_seconds: float = AGENT_CANCEL_GRACE_SECONDS):
+    """
+    Runs `fn` in a worker thread. When the deadline passes or `request`
+    reports a client disconnect, the budget is cancelled so the run stops at
+    its next step; after `grace_seconds` we stop waiting for the thread and
+    raise BudgetExceeded.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(fn))
+    cancelled_at = None
+
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=POLL_SECONDS)
+        if done:
+            return task.result()
+
+        if not budget.cancelled:
+            if budget.expired():
+                budget.cancel("deadline")
+            elif request is not None and await request.is_disconnected():
+                budget.cancel("disconnected")
+
+        if budget.cancelled:
+            cancelled_at = cancelled_at or time.monotonic()
+            if time.monotonic() - cancelled_at >= grace_seconds:
+                # The thread keeps running until its next step; retrieve its
+                # result later so the exception is not reported as unhandled.
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                raise BudgetExceeded(budget.cancel_reason)
@@ -0,0 +1,270 @@
+
+"""
+This file defines:
+- SESSIONS: per-session bookkeeping for /chat (turn history, created_at,
+  last_activity, turns in flight)
+- session_turn: runs the turns of a session one at a time
+- helpers to list, inspect, delete and reset sessions; the conversation
+  itself lives in the MemorySaver checkpointer under thread_id = session id
+- SessionReaper: background task that drops sessions idle for longer than
+  SESSION_TTL_SECONDS, and checkpointer threads left without a session
+"""
+
+import asyncio
+import os
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from threading import Lock, RLock
+
+from app.agents.langchain_agent import memory
+from app.utils.metrics import metrics
+
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_REAP_INTERVAL_SECONDS = float(os.getenv("SESSION_REAP_INTERVAL_SECONDS", "60"))
+
+TURN_WAIT_POLL_SECONDS = 0.05
+
+SESSIONS = {}
+_lock = RLock()
+
+
+class SessionBusy(Exception):
+    """The session has a turn in flight, so its conversation can't be dropped yet."""
+
+
+def begin_turn(session_id: str) -> dict:
+    with _lock:
+        session = SESSIONS.get(session_id)
+        if session is None:
+            now = datetime.utcnow()
+            session = SESSIONS[session_id] = {
+                "history": [], "created_at": now, "last_activity": now, "active": 0, "turn_lock": Lock(),
+            }
+        session["active"] += 1
+        session["last_activity"] = datetime.utcnow()
+        return session
+
+
+def end_turn(session_id: str):
+    with _lock:
+        session = SESSIONS.get(session_id)
+        if session is None:
+            return
+        session["active"] = max(0, session["active"] - 1)
+        session["last_activity"] = datetime.utcnow()
+
+
+def record_reply(session_id: str, user_msg: str, reply: str):
+    with _lock:
+        session = SESSIONS.get(session_id)
+        if session is not None:
+            session["history"].append({"user": user_msg, "bot": reply})
+
+
+@contextmanager
+def session_turn(session_id: str, check=None):
+    """
+    Runs one agent turn of a session, counted as in flight until it ends.
+    Turns of a session run one at a time: a new turn waits for an earlier
+    one that is still running (e.g. abandoned after its deadline) so they
+    don't interleave checkpoints. `check` is called while waiting and may
+    raise to give up.
+    """
+    session = begin_turn(session_id)
+    try:
+        while not session["turn_lock"].acquire(timeout=TURN_WAIT_POLL_SECONDS):
+            if check is not None:
+                check()
+        try:
+            yield session
+        finally:
+            session["turn_lock"].release()
+    finally:
+        end_turn(session_id)
+
+
+def _has_thread(session_id: str) -> bool:
+    # storage is a defaultdict: look up without creating an entry.
+    return bool(memory.storage.get(session_id))
+
+
+def _checkpoint_sizes() -> dict:
+    """thread_id -> (checkpoints, bytes) held by the MemorySaver."""
+    sizes = {}
+
+    def add(thread_id, checkpoints, size):
+        count, total = sizes.get(thread_id, (0, 0))
+        sizes[thread_id] = (count + checkpoints, total + size)
+
+    for thread_id, namespaces in list(memory.storage.items()):
+        for checkpoints in list(namespaces.values()):
+            for checkpoint, metadata, _ in list(checkpoints.values()):
+                add(thread_id, 1, len(checkpoint[1]) + len(metadata[1]))
+    for (thread_id, *_), (_, blob) in list(memory.blobs.items()):
+        add(thread_id, 0, len(blob or b""))
+    for (thread_id, *_), writes in list(memory.writes.items()):
+        add(thread_id, 0, sum(len(w[2][1]) for w in writes.values()))
+    return sizes
+
+
+def _stats(session_id: str, session: dict | None, sizes: dict, now: datetime) -> dict:
+    checkpoints, size = sizes.get(session_id, (0, 0))
+    session = session or {}
+    last_activity = session.get("last_activity")
+    return {
+        "session_id": session_id,
+        "turns": len(session.get("history", [])),
+        "checkpoints": checkpoints,
+        "size_bytes": size,
+        "created_at": session.get("created_at"),
+        "last_activity": last_activity,
+        "idle_seconds": round((now - last_activity).total_seconds(), 1) if last_activity else None,
+    }
+
+
+def list_sessions() -> list[dict]:
+    sizes = _checkpoint_sizes()
+    now = datetime.utcnow()
+    with _lock:
+        sessions = dict(SESSIONS)
+    ids = set(sessions) | {session_id for session_id, (checkpoints, _) in sizes.items() if checkpoints}
+    stats = [_stats(session_id, sessions.get(session_id), sizes, now) for session_id in ids]
+    return sorted(stats, key=lambda s: s["last_activity"] or datetime.min, reverse=True)
+
+
+def get_session(session_id: str) -> dict | None:
+    """Stats plus a compact transcript, or None if the session is unknown."""
+    with _lock:
+        session = SESSIONS.get(session_id)
+    state = memory.get_tuple({"configurable": {"thread_id": session_id}}) if _has_thread(session_id) else None
+    if session is None and state is None:
+        return None
+
+    messages = state.checkpoint["channel_values"].get("messages", []) if state else []
+    sizes = _checkpoint_sizes()
+    return {**_stats(session_id, session, sizes, datetime.utcnow()), "transcript": _transcript(messages)}
+
+
+def _transcript(messages: list) -> list[dict]:
+    roles = {"human": "user", "ai": "assistant", "tool": "tool"}
+    transcript = []
+    for msg in messages:
+        entry = {"role": roles.get(msg.type, msg.type)}
+        if msg.content:
+            entry["content"] = msg.content
+        tool_calls = getattr(msg, "tool_calls", None)
+        if tool_calls:
+            entry["tool_calls"] = [call["name"] for call in tool_calls]
+        if msg.type == "tool":
+            entry["name"] = msg.name
+        transcript.append(entry)
+    return transcript
+
+
+def delete_session(session_id: str) -> bool:
+    """Raises SessionBusy while a turn of the session is in flight."""
+    with _lock:
+        session = _idle_session(session_id)
+        known = session is not None or _has_thread(session_id)
+        SESSIONS.pop(session_id, None)
+        # Still under the lock, so no turn can start and lose its checkpoints.
+        memory.delete_thread(session_id)
+    return known
+
+
+def reset_session(session_id: str) -> bool:
+    """Forgets the conversation but keeps the session (and its created_at)."""
+    with _lock:
+        session = _idle_session(session_id)
+        known = session is not None or _has_thread(session_id)
+        if session is not None:
+            session["history"] = []
+            session["last_activity"] = datetime.utcnow()
+        memory.delete_thread(session_id)
+    return known
+
+
+def _idle_session(session_id: str) -> dict | None:
+    session = SESSIONS.get(session_id)
+    if session is not None and session["active"]:
+        # An abandoned turn counts too: it may still write checkpoints.
+        raise SessionBusy(session_id)
+    return session
+
+
+def _orphaned_threads(now: datetime, ttl_seconds: float) -> list[str]:
+    """
+    Checkpointer threads without a SESSIONS entry (e.g. written by a turn
+    whose session was dropped) whose last checkpoint is older than the TTL.
+    """
+    thread_ids = set(memory.storage)
+    thread_ids.update(key[0] for key in list(memory.blobs))
+    thread_ids.update(key[0] for key in list(memory.writes))
+    orphans = []
+    for thread_id in thread_ids - set(SESSIONS):
+        state = memory.get_tuple({"configurable": {"thread_id": thread_id}}) if _has_thread(thread_id) else None
+        if state is not None:
+            written = datetime.fromisoformat(state.checkpoint["ts"]).astimezone(timezone.utc).replace(tzinfo=None)
+            if (now - written).total_seconds() <= ttl_seconds:
+                continue
+        orphans.append(thread_id)
+    return orphans
+
+
+def reap_idle_sessions(ttl_seconds: float = SESSION_TTL_SECONDS) -> list[str]:
+    now = datetime.utcnow()
+    # Reading every thread's checkpoint is slow, so it happens before
+    # taking the lock; a thread that got a session since is kept below.
+    candidates = _orphaned_threads(now, ttl_seconds)
+    with _lock:
+        idle = [
+            session_id for session_id, session in SESSIONS.items()
+            if not session["active"] and (now - session["last_activity"]).total_seconds() > ttl_seconds
+        ]
+        for session_id in idle:
+            del SESSIONS[session_id]
+        orphans = [thread_id for thread_id in candidates if thread_id not in SESSIONS]
+        for thread_id in idle + orphans:
+            memory.delete_thread(thread_id)
+    if idle:
+        metrics.incr("chat_sessions_reaped_total", len(idle))
+        print(f"[DEBUG] Reaped {len(idle)} idle chat sessions")
+    if orphans:
+        metrics.incr("chat_orphaned_threads_reaped_total", len(orphans))
+        print(f"[DEBUG] Reaped {len(orphans)} checkpointer threads without a session")
+    return idle + orphans
+
+
+class SessionReaper:
+    def __init__(self, ttl_seconds: float = SESSION_TTL_SECONDS, interval_seconds: float = SESSION_REAP_INTERVAL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.interval_seconds = interval_seconds
+        self._task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                # Runs in a thread: it blocks on the session lock and walks the checkpointer.
+                await asyncio.to_thread(reap_idle_sessions, self.ttl_seconds)
+                metrics.set_gauge("chat_sessions", len(SESSIONS))
+            except Exception as e:
+                print(f"[ERROR] Session reaper failed: {e}")
+
+    def start(self):
+        if self.ttl_seconds <= 0:
+            return
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+session_reaper = SessionReaper()
@@ -0,0 +1,183 @@
+
+"""
+This file defines:
+- ModelWarmer: loads an Ollama model at startup and keeps it resident
+- One warmer per Ollama backend of the router (`model_warmers`); the first
+  one (`model_warmer`) gates /chat readiness
+"""
+
+import asyncio
+import os
+import time
+
+import httpx
+
+from app.agents.langchain_agent import (
+    OLLAMA_BASE_URL,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_MODEL,
+    OLLAMA_OPTIONS,
+    get_system_prompt,
+    llm_router,
+)
+from app.utils.metrics import metrics
+
+
+class ModelWarmer:
+    """
+    Warms an Ollama model with the agent system prompt and sends periodic
+    keep-alive requests so the model is not unloaded for idleness.
+
+    While the warmer is running, `is_ready()` stays False until the first
+    successful load. When it was never started (warm-up disabled, tests)
+    the app is considered ready.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        system_prompt: str | None = None,
+        keep_alive: str = OLLAMA_KEEP_ALIVE,
+        options: dict | None = None,
+        heartbeat_seconds: float = 240,
+        timeout: float = 300,
+        retry_seconds: float = 5,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.system_prompt = system_prompt or get_system_prompt()
+        self.keep_alive = keep_alive
+        self.options = dict(OLLAMA_OPTIONS if options is None else options)
+        self.heartbeat_seconds = heartbeat_seconds
+        self.timeout = timeout
+        self.retry_seconds = retry_seconds
+
+        self.started = False
+        self.ready = False
+        self.model_loaded = False
+        self._task = None
+
+    @classmethod
+    def for_backend(cls, backend, **kwargs) -> "ModelWarmer":
+        """
+        A warmer for one Ollama backend of the router, sending the same
+        keep_alive and num_ctx as the backend's chat calls: a different
+        num_ctx makes Ollama load the model again.
+        """
+        options = {key: value for key, value in OLLAMA_OPTIONS.items() if key != "num_ctx"}
+        if backend.num_ctx is not None:
+            options["num_ctx"] = backend.num_ctx
+        return cls(
+            base_url=backend.base_url,
+            model=backend.model_name,
+            keep_alive=backend.keep_alive or OLLAMA_KEEP_ALIVE,
+            options=options,
+            **kwargs,
+        )
+
+    def is_ready(self) -> bool:
+        return not self.started or self.ready
+
+    async def warm(self) -> bool:
+        """
+        Loads the model and evaluates the system prompt once.
+        Returns True when Ollama answered successfully.
+        """
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "system", "content": self.system_prompt}],
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": {**self.options, "num_predict": 1},
+        }
+        start = time.perf_counter()
+        try:
+            async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout) as client:
+                response = await client.post("/api/chat", json=payload)
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"[WARMUP] Failed to warm {self.model}: {e}")
+            metrics.incr("model_warmup_failures_total", model=self.model)
+            return False
+
+        elapsed = time.perf_counter() - start
+        metrics.observe("model_load_seconds", elapsed, model=self.model)
+        print(f"[WARMUP] {self.model} ready after {elapsed:.2f}s")
+        self.ready = True
+        self.model_loaded = True
+        return True
+
+    async def is_model_resident(self) -> bool:
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout) as client:
+            response = await client.get("/api/ps")
+            response.raise_for_status()
+        loaded = response.json().get("models", [])
+        names = {m.get("name") for m in loaded} | {m.get("model") for m in loaded}
+        return self.model in names or f"{self.model}:latest" in names
+
+    async def heartbeat_once(self):
+        """
+        Re-warms the model if Ollama unloaded it, otherwise refreshes its
+        keep-alive timer with an empty generate request.
+        """
+        try:
+            resident = await self.is_model_resident()
+        except httpx.HTTPError as e:
+            print(f"[WARMUP] Heartbeat failed for {self.model}: {e}")
+            metrics.incr("model_heartbeat_failures_total", model=self.model)
+            return
+
+        if not resident:
+            self.model_loaded = False
+            metrics.incr("model_reloads_total", model=self.model)
+            await self.warm()
+            return
+
+        try:
+            async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout) as client:
+                response = await client.post(
+                    "/api/generate",
+                    json={"model": self.model, "keep_alive": self.keep_alive, "options": self.options},
+                )
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"[WARMUP] Keep-alive failed for {self.model}: {e}")
+            metrics.incr("model_heartbeat_failures_total", model=self.model)
+
+    async def run(self):
+        while not await self.warm():
+            await asyncio.sleep(self.retry_seconds)
+        if self.heartbeat_seconds <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            await self.heartbeat_once()
+
+    def start(self):
+        self.started = True
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "true").lower() in ("1", "true", "yes")
+
+OLLAMA_HEARTBEAT_SECONDS = float(os.getenv("OLLAMA_HEARTBEAT_SECONDS", "240"))
+
+model_warmers = [
+    ModelWarmer.for_backend(backend, heartbeat_seconds=OLLAMA_HEARTBEAT_SECONDS)
+    for backend in llm_router.candidates()
+    if backend.provider == "ollama"
+]
+
+# Without any Ollama backend this warmer is never started and never gates.
+model_warmer = model_warmers[0] if model_warmers else ModelWarmer(OLLAMA_BASE_URL, OLLAMA_MODEL)
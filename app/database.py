@@ -1,7 +1,10 @@
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import sqlite3
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
 from dotenv import load_dotenv
+from pathlib import Path
 import os
 
 load_dotenv()
@@ -11,6 +14,21 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("❌ DATABASE_URL is missing in your .env file!")
 
+
+# pysqlite opens transactions lazily and RELEASE SAVEPOINT commits them, which
+# breaks savepoints inside a transaction. Let SQLAlchemy emit BEGIN instead.
+@event.listens_for(Engine, "connect")
+def _sqlite_connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.isolation_level = None
+
+
+@event.listens_for(Engine, "begin")
+def _sqlite_begin(conn):
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("BEGIN")
+
+
 engine = create_engine(
     DATABASE_URL,
     echo=False
@@ -30,3 +48,54 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def on_commit(db: Session, fn):
+    """
+    Runs `fn` after the session's current transaction commits; dropped if it
+    rolls back. Used for side effects (search index, audit events) of
+    writes that were only flushed.
+    """
+    db.info.setdefault("on_commit", []).append(fn)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.in_nested_transaction():
+        return  # a savepoint was released; the real commit comes later
+    session.info["commits"] = session.info.get("commits", 0) + 1
+    for fn in session.info.pop("on_commit", []):
+        try:
+            fn()
+        except Exception as e:
+            print(f"[ERROR] After-commit hook failed: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    if not session.in_nested_transaction():
+        session.info.pop("on_commit", None)
+
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+def run_migrations(bind=None):
+    """
+    Upgrades the database to the latest Alembic revision.
+    Databases created by the old `Base.metadata.create_all` call are
+    stamped with the initial revision first so only newer migrations run.
+    """
+    from alembic import command
+    from alembic.config import Config
+
+    cfg = Config(str(PROJECT_ROOT / "alembic.ini"))
+    cfg.set_main_option("script_location", str(PROJECT_ROOT / "migrations"))
+    cfg.attributes["configure_logger"] = False
+
+    with (bind or engine).begin() as connection:
+        cfg.attributes["connection"] = connection
+        tables = inspect(connection).get_table_names()
+        if "registrations" in tables and "alembic_version" not in tables:
+            command.stamp(cfg, "0001")
+        command.upgrade(cfg, "head")
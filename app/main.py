@@ -1,11 +1,53 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from app.database import Base, engine
+from app.database import SessionLocal, run_migrations
+from app.agents.sessions import session_reaper
+from app.agents.warmup import OLLAMA_WARMUP, model_warmers
 from app.routes.user import router as users_router
 from app.routes.chat import router as chat_router
+from app.routes.health import router as health_router
+from app.services.events import event_pipeline
+from app.services.reg_service import load_search_index
+from app.utils.rate_limit import RATE_LIMIT_ENABLED, RateLimitMiddleware, parse_rules
+
+
+def _load_search_index():
+    db = SessionLocal()
+    try:
+        load_search_index(db)
+    except Exception as e:
+        print(f"[ERROR] Building the search index failed: {e}")
+    finally:
+        db.close()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    run_migrations()
+    event_pipeline.start()
+    # Build the in-process search index in the background (no-op on PostgreSQL).
+    # Keep a reference: the event loop only holds tasks weakly.
+    index_task = asyncio.create_task(asyncio.to_thread(_load_search_index))
+    if OLLAMA_WARMUP:
+        for warmer in model_warmers:
+            warmer.start()
+    session_reaper.start()
+    yield
+    await session_reaper.stop()
+    for warmer in model_warmers:
+        await warmer.stop()
+    # Write out any queued audit events before exiting.
+    await asyncio.to_thread(event_pipeline.stop)
+
 
-Base.metadata.create_all(bind=engine)
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, rules=parse_rules(os.getenv("RATE_LIMITS")))
 
 app.include_router(users_router)
 app.include_router(chat_router)
+app.include_router(health_router)
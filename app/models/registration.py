@@ -1,7 +1,7 @@
 
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Date, DateTime, Text
+from sqlalchemy import Column, String, Date, DateTime, Text, Index, func
 from sqlalchemy.dialects.postgresql import UUID
 from app.database import Base
 
@@ -20,3 +20,11 @@ class Registration(Base):
     address = Column(Text, nullable=True)
 
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # Keep in sync with migrations/versions. The PostgreSQL-only trigram
+    # search indexes live in migration 0003.
+    __table_args__ = (
+        Index("ix_registrations_created_at", created_at),
+        Index("ix_registrations_email_lower", func.lower(email), unique=True),
+        Index("ix_registrations_phone", phone),
+    )
@@ -0,0 +1,24 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Index
+from app.database import Base
+
+
+class RegistrationEvent(Base):
+    """Append-only audit log of registration mutations (see services/events.py)."""
+
+    __tablename__ = "registration_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    action = Column(String(20), nullable=False)
+    registration_id = Column(String(36), nullable=False)
+    source = Column(String(20), nullable=False)
+    changes = Column(JSON, nullable=True)
+
+    occurred_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # Keep in sync with migrations/versions/0004.
+    __table_args__ = (
+        Index("ix_registration_events_registration_id", registration_id),
+        Index("ix_registration_events_occurred_at", occurred_at),
+    )
@@ -1,5 +1,8 @@
 
-from fastapi import APIRouter, Depends
+import os
+import time
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 from typing import Optional
@@ -7,12 +10,32 @@ from datetime import date
 
 from app.database import get_db
 from app.tools.registration_tools import RegistrationTools
+from langchain_core.messages import AIMessage, ToolMessage
 from langchain_core.tools import StructuredTool
-from app.agents.langchain_agent import create_agent_with_tools
+from langgraph.errors import GraphRecursionError
+from app.agents.langchain_agent import PROMPT_VARIANT, create_agent_with_tools
+from app.agents.run_budget import BudgetExceeded, RunBudget, run_agent
+from app.agents.sessions import (
+    SessionBusy, delete_session, get_session, list_sessions, record_reply, reset_session, session_turn,
+)
+from app.agents.warmup import model_warmer
+from app.utils.idempotency import fingerprint, idempotency_store
+from app.utils.metrics import metrics
+from app.utils.rate_limit import client_key
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
-SESSIONS = {}
+# Ollama reports a few milliseconds of load_duration even when the model is
+# already resident; a real load takes seconds.
+COLD_LOAD_SECONDS = float(os.getenv("OLLAMA_COLD_LOAD_SECONDS", "0.5"))
+
+# A failed write rolls back the whole turn; "false" keeps the turn's other writes.
+CHAT_TURN_ATOMIC = os.getenv("CHAT_TURN_ATOMIC", "true").lower() in ("1", "true", "yes")
+
+PARTIAL_REPLY = (
+    "Sorry, I couldn't finish that request in time, so no changes were saved. "
+    "Please try again."
+)
 
 class ChatMessage(BaseModel):
     message: str
@@ -30,6 +53,11 @@ class GetRegistrationInput(BaseModel):
     """Input schema for getting a user by email or ID."""
     identifier: str = Field(..., description="User's email or UUID (required)")
 
+class SearchRegistrationsInput(BaseModel):
+    """Input schema for searching users."""
+    query: str = Field(..., description="Part of the user's name, email or phone number (required)")
+
+
 class UpdateRegistrationInput(BaseModel):
     """Input schema for updating a user."""
     user_id: str = Field(..., description="User's UUID or email (required)")
@@ -44,14 +72,158 @@ class DeleteRegistrationInput(BaseModel):
     identifier: str = Field(..., description="User's email or UUID to delete (required)")
 
 
+def _turn_responses(messages: list):
+    """
+    Response metadata of the current turn's model calls (the AI messages
+    after the last user message).
+    """
+    for msg in reversed(messages):
+        if getattr(msg, "type", None) == "human":
+            break
+        meta = getattr(msg, "response_metadata", None)
+        if isinstance(meta, dict):
+            yield meta
+
+
+def _turn_phase(messages: list) -> str:
+    """
+    "cold" if one of the turn's model calls had to load the model first,
+    going by Ollama's load_duration; "unknown" for backends that don't
+    report it.
+    """
+    loads = [meta["load_duration"] for meta in _turn_responses(messages) if "load_duration" in meta]
+    if not loads:
+        return "unknown"
+    return "cold" if max(loads) / 1e9 >= COLD_LOAD_SECONDS else "warm"
+
+
+def _record_prompt_eval(messages: list):
+    """
+    Records Ollama's prompt-eval time and token count for the model calls
+    of the current turn.
+    """
+    seconds, tokens, calls = 0.0, 0, 0
+    for meta in _turn_responses(messages):
+        if "prompt_eval_duration" not in meta:
+            continue
+        seconds += (meta.get("prompt_eval_duration") or 0) / 1e9
+        tokens += meta.get("prompt_eval_count") or 0
+        calls += 1
+
+    if calls:
+        metrics.observe("prompt_eval_seconds", seconds, variant=PROMPT_VARIANT)
+        metrics.observe("prompt_eval_tokens", tokens, variant=PROMPT_VARIANT)
+
+
+def _close_interrupted_turn(agent, config: dict) -> str:
+    """
+    Ends a turn that was stopped by its budget: answers any tool calls the
+    model was still waiting on and stores a final reply, so the next turn
+    starts from a consistent history. Returns the reply for the client.
+    """
+    state = agent.get_state(config)
+    messages = state.values.get("messages", []) if state else []
+
+    closing = []
+    last = messages[-1] if messages else None
+    if isinstance(last, AIMessage) and last.tool_calls:
+        closing = [
+            ToolMessage(content="Cancelled: the request ran out of time.", tool_call_id=call["id"])
+            for call in last.tool_calls
+        ]
+    closing.append(AIMessage(content=PARTIAL_REPLY))
+    agent.update_state(config, {"messages": closing}, as_node="model")
+    return PARTIAL_REPLY
+
+
+@router.get("/sessions")
+def get_sessions():
+    return list_sessions()
+
+
+@router.get("/sessions/{session_id}")
+def get_session_detail(session_id: str):
+    session = get_session(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+
+@router.delete("/sessions/{session_id}")
+def delete_session_route(session_id: str):
+    try:
+        known = delete_session(session_id)
+    except SessionBusy:
+        raise _session_busy()
+    if not known:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"detail": "Session deleted successfully"}
+
+
+@router.post("/sessions/{session_id}/reset")
+def reset_session_route(session_id: str):
+    try:
+        known = reset_session(session_id)
+    except SessionBusy:
+        raise _session_busy()
+    if not known:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"detail": "Session reset successfully"}
+
+
+def _session_busy() -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail="A message in this session is still being processed. Please try again shortly.",
+        headers={"Retry-After": "5"},
+    )
+
+
 @router.post("/{session_id}")
-def chat(session_id: str, body: ChatMessage, db: Session = Depends(get_db)):
+async def chat(
+    session_id: str,
+    body: ChatMessage,
+    request: Request,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
+    if not model_warmer.is_ready():
+        raise HTTPException(
+            status_code=503,
+            detail="The model is still loading. Please retry shortly.",
+            headers={"Retry-After": "5"},
+        )
+
+    if idempotency_key is None:
+        return await _chat_turn(session_id, body, request, db)
+
+    # A retried turn replays the stored reply instead of running the agent again.
+    key = f"chat:{client_key(request.scope)}:{session_id}:{idempotency_key}"
+    replay = await idempotency_store.begin_async(key, fingerprint(body.model_dump()))
+    if replay is not None:
+        return replay.replay()
+    try:
+        result = await _chat_turn(session_id, body, request, db)
+    except BaseException as e:
+        idempotency_store.finish(key, error=e)
+        raise
+    # Partial turns were rolled back; let a retry run them again.
+    idempotency_store.finish(key, result, final=not result.get("partial"))
+    return result
+
+
+async def _chat_turn(session_id: str, body: ChatMessage, request: Request, db: Session) -> dict:
     user_msg = body.message.strip()
+    result = await _run_turn(session_id, user_msg, request, db)
+    record_reply(session_id, user_msg, result["reply"])
+    return result
 
-    if session_id not in SESSIONS:
-        SESSIONS[session_id] = {"history": []}
 
-    reg_tools = RegistrationTools(db)
+async def _run_turn(session_id: str, user_msg: str, request: Request, db: Session) -> dict:
+    # The agent runs in a worker thread that can outlive this request (see
+    # run_agent), so it gets its own Session instead of the request's.
+    turn_db = Session(bind=db.get_bind(), autoflush=False)
+    reg_tools = RegistrationTools(turn_db, unit_of_work=True, atomic=CHAT_TURN_ATOMIC)
 
     def create_wrapper(full_name: str, email: str, phone: str, date_of_birth: str, address: str = "") -> str:
         import json
@@ -67,14 +239,17 @@ def chat(session_id: str, body: ChatMessage, db: Session = Depends(get_db)):
     def get_wrapper(identifier: str) -> str:
         return reg_tools.get(identifier)
 
+    def search_wrapper(query: str) -> str:
+        return reg_tools.search(query)
+
     def update_wrapper(user_id: str, full_name: Optional[str] = None, email: Optional[str] = None,
                        phone: Optional[str] = None, date_of_birth: Optional[str] = None,
                        address: Optional[str] = None) -> str:
         import json
 
-        user = reg_tools._resolve_registration(user_id)
-        if not user:
-            return json.dumps({"error": f"User not found with identifier: {user_id}. Please provide a valid email or user ID."})
+        user, error = reg_tools._resolve_registration(user_id)
+        if error:
+            return json.dumps({"error": error})
 
         updates = {}
         if full_name: updates["full_name"] = full_name
@@ -105,6 +280,12 @@ def chat(session_id: str, body: ChatMessage, db: Session = Depends(get_db)):
             description="Gets a user by email or UUID",
             args_schema=GetRegistrationInput
         ),
+        StructuredTool.from_function(
+            func=search_wrapper,
+            name="search_registrations",
+            description="Finds users by part of their name, email or phone number",
+            args_schema=SearchRegistrationsInput
+        ),
         StructuredTool.from_function(
             func=update_wrapper,
             name="update_registration",
@@ -121,12 +302,57 @@ def chat(session_id: str, body: ChatMessage, db: Session = Depends(get_db)):
 
     agent = create_agent_with_tools(tools)
 
-    result = agent.invoke(
-        {"messages": [{"role": "user", "content": user_msg}]},
-        config={"configurable": {"thread_id": session_id}}
-    )
+    budget = RunBudget()
+    config = {
+        "configurable": {"thread_id": session_id},
+        "callbacks": [budget],
+        "recursion_limit": budget.recursion_limit,
+    }
+
+    def run_turn():
+        # One transaction per turn: the tools only flush, we commit once here.
+        try:
+            with session_turn(session_id, budget.check):
+                try:
+                    result = agent.invoke(
+                        {"messages": [{"role": "user", "content": user_msg}]},
+                        config=config
+                    )
+                    if reg_tools.rollback_turn:
+                        turn_db.rollback()
+                        metrics.incr("chat_turns_rolled_back_total", reason="write_failed")
+                        print(f"[WARN] Chat turn for session {session_id} rolled back: a write failed")
+                    else:
+                        turn_db.commit()
+                    return result
+                except (BudgetExceeded, GraphRecursionError) as e:
+                    turn_db.rollback()
+                    budget.cancel(e.reason if isinstance(e, BudgetExceeded) else "steps")
+                    # Repair the history here rather than in the request: this
+                    # thread may still be running after the request gave up on it.
+                    _close_interrupted_turn(agent, config)
+                    raise
+                except BaseException:
+                    turn_db.rollback()
+                    raise
+        finally:
+            metrics.observe("chat_turn_commits", turn_db.info.get("commits", 0))
+            turn_db.close()
 
+    start = time.perf_counter()
+    try:
+        result = await run_agent(run_turn, budget, request)
+    except (BudgetExceeded, GraphRecursionError) as e:
+        reason = e.reason if isinstance(e, BudgetExceeded) else "steps"
+        metrics.incr("agent_budget_exhausted_total", reason=reason)
+        budget.cancel(reason)
+        print(f"[WARN] Chat turn for session {session_id} stopped: {reason}")
+        return {"reply": PARTIAL_REPLY, "partial": True}
+
+    elapsed = time.perf_counter() - start
     messages = result.get("messages", [])
+    metrics.observe("chat_turn_seconds", elapsed, phase=_turn_phase(messages))
+    _record_prompt_eval(messages)
     if messages:
         for msg in reversed(messages):
             if hasattr(msg, 'content') and msg.content:
@@ -139,6 +365,4 @@ def chat(session_id: str, body: ChatMessage, db: Session = Depends(get_db)):
     else:
         reply = "No response"
 
-    SESSIONS[session_id]["history"].append({"user": user_msg, "bot": reply})
-
     return {"reply": reply}
@@ -0,0 +1,20 @@
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.agents.warmup import model_warmer
+from app.utils.metrics import metrics
+
+router = APIRouter(prefix="/health", tags=["Health"])
+
+
+@router.get("/ready")
+def readiness():
+    ready = model_warmer.is_ready()
+    body = {"ready": ready, "model": model_warmer.model, "model_loaded": model_warmer.model_loaded}
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+
+@router.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
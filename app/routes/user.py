@@ -1,6 +1,7 @@
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
 from sqlalchemy.orm import Session
+from typing import Optional
 from uuid import UUID
 
 from app.database import get_db
@@ -11,8 +12,11 @@ from app.services.reg_service import (
     list_registrations,
     update_registration,
     delete_registration,
-    get_registration_by_email
+    get_registration_by_email,
+    search_registrations,
 )
+from app.utils.idempotency import fingerprint, idempotency_store
+from app.utils.rate_limit import client_key
 
 router = APIRouter(
     prefix="/users",
@@ -21,7 +25,30 @@ router = APIRouter(
 
 
 @router.post("/", response_model=RegistrationOut)
-def create_user(payload: RegistrationCreate, db: Session = Depends(get_db)):
+def create_user(
+    payload: RegistrationCreate,
+    request: Request,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
+    if idempotency_key is None:
+        return _create_user(payload, db)
+
+    # Keys are per client: another client's key must not replay this response.
+    key = f"users.create:{client_key(request.scope)}:{idempotency_key}"
+    replay = idempotency_store.begin(key, fingerprint(payload.model_dump(mode="json")))
+    if replay is not None:
+        return replay.replay()
+    try:
+        body = RegistrationOut.model_validate(_create_user(payload, db)).model_dump(mode="json")
+    except Exception as e:
+        idempotency_store.finish(key, error=e)
+        raise
+    idempotency_store.finish(key, body)
+    return body
+
+
+def _create_user(payload: RegistrationCreate, db: Session):
     if get_registration_by_email(db, payload.email):
         raise HTTPException(status_code=400, detail="Email already registered")
 
@@ -35,6 +62,15 @@ def list_users(db: Session = Depends(get_db)):
     return users
 
 
+@router.get("/search", response_model=list[RegistrationOut])
+def search_users(
+    q: str = Query(..., min_length=1, description="Part of a name, email or phone number"),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db),
+):
+    return search_registrations(db, q, limit)
+
+
 @router.get("/{user_id}", response_model=RegistrationOut)
 def get_user(user_id: UUID, db: Session = Depends(get_db)):
     user = get_registration(db, user_id)
@@ -0,0 +1,290 @@
+
+"""
+Write-behind audit log for registration mutations.
+
+reg_service emits a MutationEvent after each create / update / delete. The
+event goes into a bounded in-process queue and a background thread writes
+it to the sink in batches, so the request never waits for the audit write.
+When the queue is full, emit() waits up to AUDIT_PUT_TIMEOUT_SECONDS and then
+writes the event itself (backpressure instead of losing it). stop() drains
+the queue before returning.
+
+A batch the sink keeps rejecting is retried with backoff and then appended
+to a fallback file (AUDIT_FALLBACK_PATH). Once the sink accepts a write
+again, the fallback file is moved into it.
+
+Subscribers are called with each batch after it has been written, and
+replay() reads the log back from the sink, e.g. to rebuild a cache.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+from app.database import SessionLocal
+from app.models.registration_event import RegistrationEvent
+from app.utils.metrics import metrics
+
+AUDIT_SINK = os.getenv("AUDIT_SINK", "db").lower()
+AUDIT_LOG_PATH = os.getenv("AUDIT_LOG_PATH", "audit_log.jsonl")
+AUDIT_FALLBACK_PATH = os.getenv("AUDIT_FALLBACK_PATH", "audit_fallback.jsonl")
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "0.5"))
+AUDIT_PUT_TIMEOUT_SECONDS = float(os.getenv("AUDIT_PUT_TIMEOUT_SECONDS", "0.05"))
+
+MAX_WRITE_ATTEMPTS = 3
+
+_WAKE = object()
+
+
+@dataclass
+class MutationEvent:
+    action: str                 # "created" | "updated" | "deleted"
+    registration_id: str
+    source: str                 # "api" | "chat"
+    changes: dict = field(default_factory=dict)
+    occurred_at: datetime = field(default_factory=datetime.utcnow)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["occurred_at"] = self.occurred_at.isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MutationEvent":
+        return cls(
+            action=data["action"],
+            registration_id=data["registration_id"],
+            source=data["source"],
+            changes=data.get("changes") or {},
+            occurred_at=datetime.fromisoformat(data["occurred_at"]),
+        )
+
+
+class DatabaseEventSink:
+    """Appends events to the registration_events table, one transaction per batch."""
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+
+    def write(self, events: list[MutationEvent]):
+        db = self.session_factory()
+        try:
+            db.bulk_insert_mappings(RegistrationEvent, [asdict(e) for e in events])
+            db.commit()
+        finally:
+            db.close()
+
+    def read(self, since: datetime | None = None):
+        db = self.session_factory()
+        try:
+            query = db.query(RegistrationEvent).order_by(RegistrationEvent.id)
+            if since is not None:
+                query = query.filter(RegistrationEvent.occurred_at >= since)
+            for row in query.yield_per(1_000):
+                yield MutationEvent(
+                    action=row.action,
+                    registration_id=row.registration_id,
+                    source=row.source,
+                    changes=row.changes or {},
+                    occurred_at=row.occurred_at,
+                )
+        finally:
+            db.close()
+
+
+class FileEventSink:
+    """Appends events to a JSON-lines file."""
+
+    def __init__(self, path=AUDIT_LOG_PATH):
+        self.path = Path(path)
+
+    def write(self, events: list[MutationEvent]):
+        lines = "".join(json.dumps(e.to_dict()) + "\n" for e in events)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self, since: datetime | None = None):
+        if not self.path.exists():
+            return
+        with self.path.open(encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                event = MutationEvent.from_dict(json.loads(line))
+                if since is None or event.occurred_at >= since:
+                    yield event
+
+
+class EventPipeline:
+    def __init__(
+        self,
+        sink,
+        max_queue: int = AUDIT_QUEUE_SIZE,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_seconds: float = AUDIT_FLUSH_SECONDS,
+        put_timeout: float = AUDIT_PUT_TIMEOUT_SECONDS,
+        fallback: FileEventSink | None = None,
+    ):
+        self.sink = sink
+        self.fallback = fallback
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._write_lock = threading.Lock()
+        self._subscribers = []
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def subscribe(self, callback):
+        """`callback(events)` runs in the flusher thread after each written batch."""
+        self._subscribers.append(callback)
+
+    def emit(self, event: MutationEvent):
+        if not self.running:
+            # Nothing would drain the queue (e.g. scripts or tests that do
+            # not run the app lifespan).
+            metrics.incr("audit_events_dropped_total", reason="not_started")
+            return
+        try:
+            self._queue.put(event, timeout=self.put_timeout)
+        except queue.Full:
+            metrics.incr("audit_backpressure_total")
+            self._write([event])
+            return
+        metrics.incr("audit_events_emitted_total", action=event.action)
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stops the flusher after it has written everything queued so far."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(_WAKE)   # don't wait out the flush interval
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        # Anything the flusher did not get to (join timed out).
+        self.flush()
+
+    def flush(self):
+        while not self._queue.empty():
+            batch = self._take(block=False)
+            if batch:
+                self._write(batch)
+
+    def replay(self, handler, since: datetime | None = None) -> int:
+        """Calls `handler(event)` for every logged event (oldest first)."""
+        self._recover()
+        count = 0
+        for event in self.sink.read(since):
+            handler(event)
+            count += 1
+        return count
+
+    def _take(self, block: bool) -> list[MutationEvent]:
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_seconds) if block else self._queue.get_nowait())
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return [event for event in batch if event is not _WAKE]
+
+    def _run(self):
+        # Events a previous run could only write to the fallback file.
+        self._recover()
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._take(block=True)
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: list[MutationEvent]):
+        for attempt in range(1, MAX_WRITE_ATTEMPTS + 1):
+            start = time.perf_counter()
+            try:
+                with self._write_lock:
+                    self.sink.write(batch)
+            except Exception as e:
+                print(f"[ERROR] Audit log write failed (attempt {attempt}): {e}")
+                metrics.incr("audit_write_failures_total")
+                if attempt < MAX_WRITE_ATTEMPTS:
+                    time.sleep(self.flush_seconds * 2 ** (attempt - 1))
+                    continue
+                if not self._write_fallback(batch):
+                    return
+            else:
+                self._recover()
+            break
+
+        metrics.observe("audit_flush_seconds", time.perf_counter() - start)
+        metrics.observe("audit_flush_batch_size", len(batch))
+        metrics.set_gauge("audit_queue_depth", self._queue.qsize())
+        for callback in self._subscribers:
+            try:
+                callback(batch)
+            except Exception as e:
+                print(f"[ERROR] Audit subscriber failed: {e}")
+
+
+    def _write_fallback(self, batch: list[MutationEvent]) -> bool:
+        if self.fallback is None:
+            metrics.incr("audit_events_dropped_total", value=len(batch), reason="write_failed")
+            return False
+        try:
+            with self._write_lock:
+                self.fallback.write(batch)
+        except Exception as e:
+            print(f"[ERROR] Audit fallback write failed, {len(batch)} events lost: {e}")
+            metrics.incr("audit_events_dropped_total", value=len(batch), reason="fallback_failed")
+            return False
+        print(f"[WARN] Audit log unavailable, wrote {len(batch)} events to {self.fallback.path}")
+        metrics.incr("audit_events_fallback_total", value=len(batch))
+        return True
+
+    def _recover(self):
+        """Moves the events in the fallback file into the sink."""
+        if self.fallback is None or not self.fallback.path.exists():
+            return
+        try:
+            with self._write_lock:
+                events = list(self.fallback.read())
+                if events:
+                    self.sink.write(events)
+                self.fallback.path.unlink()
+        except Exception as e:
+            print(f"[ERROR] Audit fallback recovery failed: {e}")
+            return
+        print(f"[DEBUG] Moved {len(events)} audit events from {self.fallback.path} to the audit log")
+        metrics.incr("audit_events_recovered_total", value=len(events))
+
+
+def sink_from_env():
+    if AUDIT_SINK == "file":
+        return FileEventSink(AUDIT_LOG_PATH)
+    return DatabaseEventSink()
+
+
+event_pipeline = EventPipeline(sink_from_env(), fallback=FileEventSink(AUDIT_FALLBACK_PATH))
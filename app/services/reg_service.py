@@ -1,11 +1,15 @@
 
+from sqlalchemy import case, func, or_
 from sqlalchemy.orm import Session
 from app.models.registration import Registration
 from app.schemas.registration import RegistrationCreate, RegistrationUpdate
+from app.database import on_commit
+from app.services import search_index
+from app.services.events import MutationEvent, event_pipeline
 import uuid
 
 
-def create_registration(db: Session, data: RegistrationCreate) -> Registration:
+def create_registration(db: Session, data: RegistrationCreate, source: str = "api", commit: bool = True) -> Registration:
     new_reg = Registration(
         full_name=data.full_name,
         email=data.email,
@@ -15,8 +19,10 @@ def create_registration(db: Session, data: RegistrationCreate) -> Registration:
     )
 
     db.add(new_reg)
-    db.commit()
-    db.refresh(new_reg)
+    _save(db, new_reg, commit)
+    _after_write(db, commit, _index_upsert(db, new_reg), MutationEvent(
+        "created", str(new_reg.id), source, data.model_dump(mode="json")
+    ))
     return new_reg
 
 
@@ -25,7 +31,17 @@ def get_registration(db: Session, reg_id: uuid.UUID) -> Registration | None:
 
 
 def get_registration_by_email(db: Session, email: str) -> Registration | None:
-    return db.query(Registration).filter(Registration.email == email).first()
+    # Case-insensitive, served by the lower(email) index.
+    return (
+        db.query(Registration)
+        .filter(func.lower(Registration.email) == email.lower())
+        .first()
+    )
+
+
+def find_registrations_by_phone(db: Session, phone: str, limit: int = 10) -> list[Registration]:
+    # Phone numbers are not unique (families share one).
+    return db.query(Registration).filter(Registration.phone == phone).limit(limit).all()
 
 
 def list_registrations(db: Session, limit: int = 50):
@@ -37,18 +53,123 @@ def list_registrations(db: Session, limit: int = 50):
     )
 
 
-def update_registration(db: Session, reg: Registration, updates: RegistrationUpdate) -> Registration:
+def update_registration(
+    db: Session, reg: Registration, updates: RegistrationUpdate, source: str = "api", commit: bool = True
+) -> Registration:
     update_data = updates.dict(exclude_unset=True)
 
     for field, value in update_data.items():
         setattr(reg, field, value)
 
     db.add(reg)
-    db.commit()
-    db.refresh(reg)
+    _save(db, reg, commit)
+    _after_write(db, commit, _index_upsert(db, reg), MutationEvent(
+        "updated", str(reg.id), source, updates.model_dump(mode="json", exclude_unset=True)
+    ))
     return reg
 
 
-def delete_registration(db: Session, reg: Registration):
+def delete_registration(db: Session, reg: Registration, source: str = "api", commit: bool = True):
+    reg_id = reg.id
     db.delete(reg)
+    _save(db, None, commit)
+    _after_write(db, commit, lambda: _index_remove(db, reg_id), MutationEvent("deleted", str(reg_id), source))
+
+
+def search_registrations(db: Session, query: str, limit: int = 10) -> list[Registration]:
+    """
+    Ranked prefix / substring / fuzzy search over name, email and phone.
+    PostgreSQL uses the pg_trgm indexes; other databases use the
+    in-process n-gram index in search_index.py.
+    """
+    query = query.strip()
+    if not query:
+        return []
+
+    if db.get_bind().dialect.name == "postgresql":
+        # Same normalization as the in-process index (e.g. phone separators).
+        return _search_registrations_pg(db, search_index.normalize_query(query), limit)
+
+    hits = load_search_index(db).search(query, limit)
+    if not hits:
+        return []
+
+    found = {r.id: r for r in db.query(Registration).filter(Registration.id.in_([i for i, _ in hits]))}
+    return [found[reg_id] for reg_id, _ in hits if reg_id in found]
+
+
+def load_search_index(db: Session) -> search_index.RegistrationSearchIndex | None:
+    """
+    Builds the in-process search index for this database if it is not
+    loaded yet. Returns None on PostgreSQL, which searches in SQL.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return None
+    index = search_index.index_for(db.get_bind())
+    index.ensure_loaded(lambda: db.query(
+        Registration.id, Registration.full_name, Registration.email, Registration.phone
+    ).yield_per(10_000))
+    return index
+
+
+def _search_registrations_pg(db: Session, query: str, limit: int) -> list[Registration]:
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    fields = [func.lower(Registration.full_name), func.lower(Registration.email), Registration.phone]
+
+    def like(pattern):
+        return or_(*(f.like(pattern, escape="\\") for f in fields))
+
+    tier = case(
+        (or_(*(f == query for f in fields)), 0),
+        (like(f"{escaped}%"), 1),
+        else_=2,
+    )
+    similarity = func.greatest(*(func.similarity(f, query) for f in fields))
+    return (
+        db.query(Registration)
+        .filter(or_(like(f"%{escaped}%"), *(f.op("%")(query) for f in fields)))
+        .order_by(tier, similarity.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def _save(db: Session, reg: Registration | None, commit: bool):
+    """
+    commit=False only flushes, leaving the commit to the caller (the chat
+    unit of work, see RegistrationTools).
+    """
+    if not commit:
+        db.flush()
+        return
     db.commit()
+    if reg is not None:
+        db.refresh(reg)
+
+
+def _after_write(db: Session, commit: bool, update_index, event: MutationEvent):
+    def publish():
+        update_index()
+        event_pipeline.emit(event)
+
+    if commit:
+        publish()
+    else:
+        on_commit(db, publish)
+
+
+def _index_upsert(db: Session, reg: Registration):
+    # Read the fields now: after a deferred commit they are expired.
+    fields = (reg.id, reg.full_name, reg.email, reg.phone)
+
+    def upsert():
+        index = search_index.existing_index_for(db.get_bind())
+        if index is not None:
+            index.upsert(*fields)
+    return upsert
+
+
+def _index_remove(db: Session, reg_id):
+    index = search_index.existing_index_for(db.get_bind())
+    if index is not None:
+        index.remove(reg_id)
@@ -0,0 +1,366 @@
+
+"""
+In-process n-gram index for registration search.
+
+Used when the database has no trigram support (SQLite). Each registration's
+name, email and phone are split into tokens; every token contributes its
+trigrams plus "^"-anchored prefix grams, and each gram maps to the sorted
+array of documents containing it. A query is answered in tiers, stopping once
+`limit` results are found: exact field match, token prefix match (anchored
+grams), substring match (plain trigrams) and, when nothing matched, fuzzy
+trigram similarity. Postings are intersected lazily, rarest first, so
+unselective queries stop after a few hundred documents.
+
+Postings are array("I") rather than sets (4 bytes per entry instead of
+about 30), and documents keep only their normalized fields.
+
+load() builds the new index without holding the lock and swaps it in, so
+writes and searches carry on while it runs; writes made during the build
+are replayed onto the new index before the swap.
+"""
+
+import heapq
+import math
+import re
+import weakref
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from operator import itemgetter
+from threading import Lock, RLock
+
+SPLIT_RE = re.compile(r"[\s@._\-+()]+")
+PHONE_NOISE_RE = re.compile(r"[\s\-\(\)\.]+")
+
+EXACT, PREFIX, SUBSTRING = 3.0, 2.0, 1.0
+# Candidates verified per tier before giving up on finding more.
+MAX_CANDIDATES = 2_000
+MIN_FUZZY_SIMILARITY = 0.3
+# Checking a doc against a posting (bisect) costs about as much as counting
+# this many posting entries.
+BISECT_COST = 8
+
+_EMPTY = array("I")
+
+
+def normalize(value: str) -> str:
+    return (value or "").strip().lower()
+
+
+def normalize_query(query: str) -> str:
+    query = normalize(query)
+    digits = PHONE_NOISE_RE.sub("", query)
+    # Phone numbers are stored without separators.
+    return digits if re.fullmatch(r"\+?\d+", digits) else query
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _tokens(fields: tuple[str, ...]) -> tuple[str, ...]:
+    tokens = set(fields)
+    for field in fields:
+        tokens.update(SPLIT_RE.split(field))
+    tokens.discard("")
+    return tuple(tokens)
+
+
+def _doc_grams(fields: tuple[str, ...]) -> set[str]:
+    grams = set()
+    for token in _tokens(fields):
+        anchored = "^" + token
+        grams.add(anchored[:2])
+        grams |= trigrams(anchored)
+    return grams
+
+
+def _prefix_grams(query: str) -> set[str]:
+    anchored = "^" + query
+    return trigrams(anchored) if len(anchored) >= 3 else {anchored}
+
+
+def _token_prefix_re(query: str) -> re.Pattern:
+    # Same tokens as _tokens(): a whole field, or what follows a separator.
+    return re.compile(r"(?:^|(?<=[\s@._\-+()]))" + re.escape(query))
+
+
+def _contains(posting: array, doc: int) -> bool:
+    i = bisect_left(posting, doc)
+    return i < len(posting) and posting[i] == doc
+
+
+def _best_hits(postings: list[array], min_hits: int, limit: int, budget: int) -> dict | None:
+    """
+    Finds the `limit` docs holding the most postings without counting them
+    all. Every doc in `need` postings is in one of the first
+    len - need + 1, so `need` starts at all of them and drops one posting at
+    a time until `limit` docs reach it; a doc is checked against a posting
+    only while it can still reach `need`. Returns {doc: hits}, or None once
+    more than `budget` checks were made (counting is cheaper then).
+    """
+    total = len(postings)
+    seen = set()
+    hits = {}                       # doc -> hits, once checked against every posting
+    waiting = defaultdict(list)     # most hits a doc can still reach -> [(doc, hits, next posting)]
+
+    def check(doc, found, at, need):
+        nonlocal budget
+        while at < total and found + total - at >= need:
+            found += _contains(postings[at], doc)
+            at += 1
+            budget -= 1
+        if at < total:
+            waiting[found + total - at].append((doc, found, at))
+            return False
+        hits[doc] = found
+        return found >= need
+
+    for seed in range(total - min_hits + 1):
+        need = total - seed
+        # Nothing left can beat `need` hits, so `limit` docs with `need`
+        # are a complete answer.
+        reached = sum(1 for found in hits.values() if found >= need)
+        for doc, found, at in waiting.pop(need, ()):
+            reached += check(doc, found, at, need)
+        for doc in postings[seed]:
+            if reached >= limit:
+                return hits
+            if budget < 0:
+                return None
+            if doc not in seen:
+                # Not in any rarer posting, or it would have been seen.
+                seen.add(doc)
+                reached += check(doc, 1, seed + 1, need)
+        if reached >= limit:
+            return hits
+    return hits
+
+
+def _count_hits(postings: list[array], seeds: int, min_hits: int) -> Counter:
+    """
+    Counts every doc in the first `seeds` postings in each of the postings.
+    Before a posting larger than the candidate set, docs that the postings
+    left can't bring to `min_hits` are dropped, which often leaves few
+    enough candidates to bisect instead of scanning the posting.
+    """
+    counts = Counter()
+    for posting in postings[:seeds]:
+        counts.update(posting)
+    candidates = set(counts)
+    total = len(postings)
+    for at in range(seeds, total):
+        posting = postings[at]
+        short = min_hits - (total - at)
+        if short > 1 and len(posting) > len(candidates):
+            candidates = {doc for doc in candidates if counts[doc] >= short}
+        if len(posting) <= len(candidates) * BISECT_COST:
+            counts.update(candidates.intersection(posting))
+        else:
+            counts.update([doc for doc in candidates if _contains(posting, doc)])
+    return counts
+
+
+class RegistrationSearchIndex:
+    def __init__(self):
+        self._lock = RLock()
+        self._load_lock = Lock()
+        self._postings = {}    # gram -> array of doc ids, ascending
+        self._exact = {}       # field value -> array of doc ids, ascending
+        self._docs = []        # doc id -> (registration id, fields), None once removed
+        self._doc_ids = {}     # registration id -> doc id
+        self._replay = None    # writes made while load() builds a new index
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._doc_ids)
+
+    def load(self, rows):
+        """rows: iterable of (id, full_name, email, phone)."""
+        with self._load_lock:
+            self._load(rows)
+
+    def ensure_loaded(self, rows_fn):
+        """Loads the index from `rows_fn()` the first time it is needed."""
+        if self.loaded:
+            return
+        with self._load_lock:
+            if not self.loaded:
+                self._load(rows_fn())
+
+    def _load(self, rows):
+        with self._lock:
+            self._replay = []
+        fresh = RegistrationSearchIndex()
+        try:
+            for row in rows:
+                fresh.upsert(*row)
+        except BaseException:
+            with self._lock:
+                self._replay = None
+            raise
+
+        with self._lock:
+            for args in self._replay:
+                if len(args) == 1:
+                    fresh.remove(*args)
+                else:
+                    fresh.upsert(*args)
+            self._replay = None
+            self._postings, self._exact = fresh._postings, fresh._exact
+            self._docs, self._doc_ids = fresh._docs, fresh._doc_ids
+            self.loaded = True
+
+    def upsert(self, reg_id, full_name: str, email: str, phone: str):
+        fields = (normalize(full_name), normalize(email), PHONE_NOISE_RE.sub("", normalize(phone)))
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((reg_id, full_name, email, phone))
+            self._remove(reg_id)
+            # New docs get the highest id, so appending keeps postings sorted.
+            doc = len(self._docs)
+            self._docs.append((reg_id, fields))
+            self._doc_ids[reg_id] = doc
+            for field in set(fields):
+                if field:
+                    self._add(self._exact, field, doc)
+            postings = self._postings
+            for gram in _doc_grams(fields):
+                try:
+                    postings[gram].append(doc)
+                except KeyError:
+                    postings[gram] = array("I", (doc,))
+
+    def remove(self, reg_id):
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((reg_id,))
+            self._remove(reg_id)
+
+    def _remove(self, reg_id):
+        doc = self._doc_ids.pop(reg_id, None)
+        if doc is None:
+            return
+        _, fields = self._docs[doc]
+        self._docs[doc] = None
+        for field in set(fields):
+            if field:
+                self._discard(self._exact, field, doc)
+        for gram in _doc_grams(fields):
+            self._discard(self._postings, gram, doc)
+
+    @staticmethod
+    def _add(mapping, key, doc):
+        posting = mapping.get(key)
+        if posting is None:
+            mapping[key] = array("I", (doc,))
+        else:
+            posting.append(doc)
+
+    @staticmethod
+    def _discard(mapping, key, doc):
+        posting = mapping.get(key)
+        if posting is None:
+            return
+        i = bisect_left(posting, doc)
+        if i < len(posting) and posting[i] == doc:
+            del posting[i]
+            if not posting:
+                del mapping[key]
+
+    def _containing_all(self, grams: set[str]):
+        postings = [self._postings.get(gram) for gram in grams]
+        if not postings or not all(postings):
+            return iter(())
+        postings.sort(key=len)
+        first, rest = postings[0], postings[1:]
+        return (doc for doc in first if all(_contains(p, doc) for p in rest))
+
+    def _collect(self, docs, verify, score, results: dict, limit: int):
+        """
+        Verifies candidate docs and adds up to the missing number of results,
+        preferring shorter fields among equal matches.
+        """
+        wanted = limit - len(results)
+        found = []
+        for scanned, doc in enumerate(docs):
+            if scanned >= MAX_CANDIDATES or len(found) >= wanted * 4:
+                break
+            if doc not in results and verify(self._docs[doc][1]):
+                found.append(doc)
+        for doc in heapq.nsmallest(wanted, found, key=self._shortest_field):
+            results[doc] = score - self._shortest_field(doc) / 100_000
+
+    def _shortest_field(self, doc: int) -> int:
+        return min(len(f) for f in self._docs[doc][1] if f)
+
+    def _fuzzy(self, query: str, results: dict, limit: int):
+        """
+        Ranks docs by the share of the query's trigrams they contain. A doc
+        reaching MIN_FUZZY_SIMILARITY holds `min_hits` of the grams, so it
+        is in one of the `total - min_hits + 1` rarest postings; the common
+        ones are never needed to find candidates, only to score them.
+        """
+        grams = trigrams(query)
+        postings = sorted((p for p in map(self._postings.get, grams) if p), key=len)
+        min_hits = max(1, math.ceil(MIN_FUZZY_SIMILARITY * len(grams)))
+        if len(postings) < min_hits:
+            return
+
+        seeds = postings[:len(postings) - min_hits + 1]
+        budget = sum(map(len, seeds)) // BISECT_COST
+        hits = _best_hits(postings, min_hits, limit, budget)
+        if hits is None:
+            hits = _count_hits(postings, len(seeds), min_hits)
+
+        for doc, found in heapq.nlargest(limit, hits.items(), key=itemgetter(1)):
+            if found >= min_hits:
+                results[doc] = round(found / len(grams) * 0.99, 3)
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[object, float]]:
+        """
+        Returns up to `limit` (registration id, score) pairs, best first.
+        Scores: ~3 exact, ~2 prefix, ~1 substring, below 1 fuzzy similarity.
+        """
+        query = normalize_query(query)
+        if not query or limit <= 0:
+            return []
+
+        results = {}
+        with self._lock:
+            self._collect(self._exact.get(query, ()), lambda fields: True, EXACT, results, limit)
+            if len(results) < limit:
+                prefix = _token_prefix_re(query)
+                self._collect(
+                    self._containing_all(_prefix_grams(query)),
+                    lambda fields: any(prefix.search(f) for f in fields),
+                    PREFIX, results, limit,
+                )
+            if len(results) < limit and len(query) >= 3:
+                self._collect(
+                    self._containing_all(trigrams(query)),
+                    lambda fields: any(query in f for f in fields),
+                    SUBSTRING, results, limit,
+                )
+            if not results and len(query) >= 3:
+                self._fuzzy(query, results, limit)
+
+            ranked = sorted(results.items(), key=lambda item: -item[1])
+            return [(self._docs[doc][0], round(score, 3)) for doc, score in ranked]
+
+
+_indexes = weakref.WeakKeyDictionary()
+_indexes_lock = RLock()
+
+
+def index_for(bind) -> RegistrationSearchIndex:
+    """One index per engine, created lazily."""
+    with _indexes_lock:
+        index = _indexes.get(bind)
+        if index is None:
+            index = _indexes[bind] = RegistrationSearchIndex()
+        return index
+
+
+def existing_index_for(bind) -> RegistrationSearchIndex | None:
+    return _indexes.get(bind)
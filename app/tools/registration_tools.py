@@ -1,20 +1,62 @@
 import json
+import re
+from contextlib import contextmanager
 from sqlalchemy.orm import Session
 from app.schemas.registration import RegistrationCreate, RegistrationUpdate
 from app.services.reg_service import (
     create_registration,
     get_registration,
     get_registration_by_email,
+    find_registrations_by_phone,
     update_registration,
     delete_registration,
+    search_registrations,
 )
 
+TURN_ROLLED_BACK = (
+    "Nothing from this message was saved, because one of its changes failed. "
+    "Tell the user, and ask them to try again."
+)
+
+
 class RegistrationTools:
-    def __init__(self, db: Session):
+    """
+    With unit_of_work=True the writes are only flushed, each inside its own
+    savepoint, and the caller commits (or rolls back) once for the whole
+    chat turn. With atomic=True (the default) a failed write fails the
+    whole turn: `rollback_turn` is set, later writes are refused and the
+    caller must roll back instead of committing. With atomic=False a failed
+    write rolls back its savepoint only.
+    """
+
+    def __init__(self, db: Session, unit_of_work: bool = False, atomic: bool = True):
         self.db = db
+        self.unit_of_work = unit_of_work
+        self.atomic = atomic
+        self.rollback_turn = False
+
+    @contextmanager
+    def _write(self):
+        if not self.unit_of_work:
+            yield
+            return
+        try:
+            # The savepoint keeps the session usable after a failed flush.
+            with self.db.begin_nested():
+                yield
+        except Exception:
+            self.rollback_turn = self.atomic
+            raise
+
+    def _error(self, payload: dict) -> str:
+        if self.rollback_turn:
+            payload["note"] = TURN_ROLLED_BACK
+        return json.dumps(payload)
 
     def create(self, payload_str: str) -> str:
         print(f"[DEBUG] create() called with payload: {payload_str}, type: {type(payload_str)}")
+        if self.rollback_turn:
+            return json.dumps({"error": TURN_ROLLED_BACK})
         try:
             if isinstance(payload_str, dict):
                 payload = payload_str
@@ -77,7 +119,8 @@ class RegistrationTools:
             return json.dumps({"error": "Invalid input format. Please provide all required fields correctly."})
 
         try:
-            obj = create_registration(self.db, data)
+            with self._write():
+                obj = create_registration(self.db, data, source="chat", commit=not self.unit_of_work)
             print(f"[DEBUG] Created registration with ID: {obj.id}")
             return json.dumps({
                 "id": str(obj.id),
@@ -90,13 +133,17 @@ class RegistrationTools:
 
             if "duplicate key" in error_msg.lower() or "unique constraint" in error_msg.lower():
                 if "email" in error_msg.lower():
-                    return json.dumps({"error": f"A user with email {data.email} already exists. Please use a different email address."})
+                    return self._error({"error": f"A user with email {data.email} already exists. Please use a different email address."})
                 else:
-                    return json.dumps({"error": "This user already exists in the system."})
+                    return self._error({"error": "This user already exists in the system."})
 
-            return json.dumps({"error": "Failed to create registration. Please try again."})
+            return self._error({"error": "Failed to create registration. Please try again."})
 
     def _resolve_registration(self, identifier: str):
+        """
+        Returns (registration, error). Phone numbers are not unique, so a
+        phone that matches several users is refused instead of guessing.
+        """
         import uuid
         reg = None
         try:
@@ -107,13 +154,19 @@ class RegistrationTools:
 
         if not reg:
             reg = get_registration_by_email(self.db, identifier)
-        return reg
+        if not reg:
+            matches = find_registrations_by_phone(self.db, re.sub(r'[\s\-\(\)\.]+', '', identifier), limit=2)
+            if len(matches) > 1:
+                return None, f"More than one user has the phone number {identifier}. Please use their email or ID instead."
+            reg = matches[0] if matches else None
+        if not reg:
+            return None, f"User not found with identifier: {identifier}. Please check the email or ID."
+        return reg, None
 
     def get(self, identifier: str) -> str:
-        reg = self._resolve_registration(identifier)
-
-        if not reg:
-            return json.dumps({"error": f"User not found with identifier: {identifier}. Please check the email or ID."})
+        reg, error = self._resolve_registration(identifier)
+        if error:
+            return json.dumps({"error": error})
 
         return json.dumps({
             "id": str(reg.id),
@@ -124,7 +177,25 @@ class RegistrationTools:
             "address": reg.address
         })
 
+    def search(self, query: str, limit: int = 5) -> str:
+        matches = search_registrations(self.db, query, limit)
+
+        if not matches:
+            return json.dumps({"error": f"No users found matching: {query}. Ask the user for more details."})
+
+        return json.dumps({"matches": [
+            {
+                "id": str(reg.id),
+                "full_name": reg.full_name,
+                "email": reg.email,
+                "phone": reg.phone,
+            }
+            for reg in matches
+        ]})
+
     def update(self, payload_str: str) -> str:
+        if self.rollback_turn:
+            return json.dumps({"error": TURN_ROLLED_BACK})
         try:
             if isinstance(payload_str, dict):
                 payload = payload_str
@@ -135,18 +206,21 @@ class RegistrationTools:
         except Exception as e:
             return json.dumps({"error": str(e)})
 
-        reg = self._resolve_registration(reg_id)
-        if not reg:
-            return json.dumps({"error": f"User not found with identifier: {reg_id}. Please check the email or ID."})
+        reg, error = self._resolve_registration(reg_id)
+        if error:
+            return json.dumps({"error": error})
 
-        updated = update_registration(self.db, reg, updates)
+        with self._write():
+            updated = update_registration(self.db, reg, updates, source="chat", commit=not self.unit_of_work)
         return json.dumps({"status": "ok", "id": str(updated.id)})
 
     def delete(self, identifier: str) -> str:
-        reg = self._resolve_registration(identifier)
-
-        if not reg:
-            return json.dumps({"error": f"User not found with identifier: {identifier}. Please check the email or ID."})
-
-        delete_registration(self.db, reg)
+        if self.rollback_turn:
+            return json.dumps({"error": TURN_ROLLED_BACK})
+        reg, error = self._resolve_registration(identifier)
+        if error:
+            return json.dumps({"error": error})
+
+        with self._write():
+            delete_registration(self.db, reg, source="chat", commit=not self.unit_of_work)
         return json.dumps({"status": "deleted"})
@@ -0,0 +1,158 @@
+
+"""
+Idempotency-Key support for POST endpoints.
+
+The first request with a given key does the work; its response is stored
+for IDEMPOTENCY_TTL_SECONDS and replayed (with an `Idempotent-Replayed: true`
+header) to retries with the same key. A retry that arrives while the first
+request is still running waits for it instead of doing the work again.
+Reusing a key for a different request body is rejected with 422. Endpoints
+scope keys to the client (rate_limit.client_key), so two clients sending the
+same key never see each other's responses.
+
+Only final answers are stored: on exceptions, 5xx responses and results the
+endpoint marks as not final, the key is released so a retry runs again.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from app.utils.metrics import metrics
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "90"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+PURGE_SECONDS = 60
+
+
+def fingerprint(payload) -> str:
+    data = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+@dataclass
+class StoredResponse:
+    status_code: int
+    body: object
+
+    def replay(self) -> JSONResponse:
+        return JSONResponse(status_code=self.status_code, content=self.body, headers={REPLAYED_HEADER: "true"})
+
+
+@dataclass
+class _Entry:
+    fingerprint: str
+    done: threading.Event = field(default_factory=threading.Event)
+    response: StoredResponse | None = None
+    expires_at: float | None = None     # set once completed
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+
+    def _claim(self, key: str, fp: str):
+        """
+        Returns (stored response, None) to replay, (None, event) to wait on
+        an in-flight request, or (None, None) when the caller owns the key.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_purge or len(self._entries) >= self.max_keys:
+                self._purge(now)
+            entry = self._entries.get(key)
+            if entry is None or (entry.expires_at is not None and entry.expires_at <= now):
+                self._entries[key] = _Entry(fp)
+                return None, None
+            if entry.fingerprint != fp:
+                raise HTTPException(
+                    status_code=422,
+                    detail="Idempotency-Key was already used for a different request.",
+                )
+            if entry.response is not None:
+                metrics.incr("idempotency_replays_total")
+                return entry.response, None
+            return None, entry.done
+
+    def _purge(self, now: float):
+        self._next_purge = now + PURGE_SECONDS
+        expired = [k for k, e in self._entries.items() if e.expires_at is not None and e.expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        if len(self._entries) >= self.max_keys:
+            # Still full: forget the oldest completed responses.
+            completed = sorted((e.expires_at, k) for k, e in self._entries.items() if e.expires_at is not None)
+            for _, key in completed[: len(completed) // 10 + 1]:
+                del self._entries[key]
+
+    def begin(self, key: str, fp: str, wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS) -> StoredResponse | None:
+        """Returns a response to replay, or None if the caller should do the work."""
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            response, in_flight = self._claim(key, fp)
+            if in_flight is None:
+                return response
+            metrics.incr("idempotency_waits_total")
+            if not in_flight.wait(max(0.0, deadline - time.monotonic())):
+                raise _still_running()
+
+    async def begin_async(self, key: str, fp: str, wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS) -> StoredResponse | None:
+        """begin() for async endpoints: waits in a worker thread."""
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            response, in_flight = self._claim(key, fp)
+            if in_flight is None:
+                return response
+            metrics.incr("idempotency_waits_total")
+            if not await asyncio.to_thread(in_flight.wait, max(0.0, deadline - time.monotonic())):
+                raise _still_running()
+
+    def complete(self, key: str, status_code: int, body):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.response = StoredResponse(status_code, body)
+            entry.expires_at = time.monotonic() + self.ttl_seconds
+        entry.done.set()
+
+    def release(self, key: str):
+        """Forgets an unfinished key so the next request with it runs again."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.done.set()
+
+    def finish(self, key: str, body=None, error: BaseException | None = None, final: bool = True):
+        """Stores the endpoint's outcome: its body, or the HTTPException it raised."""
+        if isinstance(error, HTTPException) and error.status_code < 500:
+            self.complete(key, error.status_code, {"detail": error.detail})
+        elif error is None and final:
+            self.complete(key, 200, body)
+        else:
+            self.release(key)
+
+
+def _still_running() -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail="A request with this Idempotency-Key is still in progress.",
+        headers={"Retry-After": "5"},
+    )
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,204 @@
+
+"""
+Token-bucket rate limiting as ASGI middleware.
+
+Each rule covers a path prefix (and optionally some methods) and gives every
+client its own bucket: `burst` requests at once, refilled at `rate` per
+second. A client is its IP, or its API key (RATE_LIMIT_KEY_HEADER) when the
+key is one of RATE_LIMIT_API_KEYS; any other key is ignored, so a client
+can't pick a fresh bucket by sending a new header. Rules with `by_session`
+also give every chat session a bucket (`session_rate` / `session_burst`).
+A request takes a token from the client's and the session's bucket or from
+neither, so one that is refused costs nothing. Paths without a rule (/health, /docs) are not
+limited.
+
+Buckets live in memory by default. Several app instances can share limits
+through any BucketStore whose take() is atomic (e.g. a Redis script). take()
+is awaited on the event loop, so stores must do their I/O asynchronously.
+"""
+
+import json
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from threading import Lock
+
+from app.utils.metrics import metrics
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_KEY_HEADER = os.getenv("RATE_LIMIT_KEY_HEADER", "X-API-Key")
+RATE_LIMIT_API_KEYS = frozenset(k.strip() for k in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if k.strip())
+
+DEFAULT_RULES = [
+    {"path": "/chat", "methods": ["POST"], "rate": 2, "burst": 30,
+     "by_session": True, "session_rate": 0.5, "session_burst": 10},
+    {"path": "/chat/sessions", "rate": 5, "burst": 20},
+    {"path": "/users", "methods": ["POST", "PUT", "DELETE"], "rate": 5, "burst": 50},
+    {"path": "/users", "methods": ["GET"], "rate": 50, "burst": 200},
+]
+
+
+@dataclass(frozen=True)
+class RateRule:
+    path: str
+    rate: float                         # tokens per second
+    burst: int
+    methods: frozenset | None = None    # None: every method
+    by_session: bool = False            # also limit the path segment after `path`
+    session_rate: float | None = None   # default: rate
+    session_burst: int | None = None    # default: burst
+
+    @property
+    def name(self) -> str:
+        methods = ",".join(sorted(self.methods)) if self.methods else "*"
+        return f"{methods} {self.path}"
+
+    def matches(self, method: str, path: str) -> bool:
+        if self.methods is not None and method not in self.methods:
+            return False
+        return path == self.path or path.startswith(self.path + "/")
+
+
+def parse_rules(raw: str | None) -> list[RateRule]:
+    """RATE_LIMITS is a JSON list shaped like DEFAULT_RULES."""
+    specs = json.loads(raw) if raw else DEFAULT_RULES
+    rules = []
+    for spec in specs:
+        rate = _positive(spec, "rate")
+        session_rate = _positive(spec, "session_rate") if "session_rate" in spec else None
+        rules.append(RateRule(
+            path=spec["path"].rstrip("/") or "/",
+            rate=rate,
+            burst=_burst(spec, "burst", rate),
+            methods=frozenset(m.upper() for m in spec["methods"]) if spec.get("methods") else None,
+            by_session=bool(spec.get("by_session", False)),
+            session_rate=session_rate,
+            session_burst=_burst(spec, "session_burst", rate) if "session_burst" in spec else None,
+        ))
+    # Most specific prefix wins.
+    return sorted(rules, key=lambda r: len(r.path), reverse=True)
+
+
+def _positive(spec: dict, field: str) -> float:
+    value = float(spec[field])
+    if not value > 0:
+        # A zero rate never refills: the bucket would lock clients out for good.
+        raise ValueError(f"RATE_LIMITS: {field} for {spec['path']} must be greater than 0, got {spec[field]}")
+    return value
+
+
+def _burst(spec: dict, field: str, rate: float) -> int:
+    burst = int(spec.get(field, max(1, math.ceil(rate))))
+    if burst < 1:
+        raise ValueError(f"RATE_LIMITS: {field} for {spec['path']} must be at least 1, got {spec[field]}")
+    return burst
+
+
+def client_key(scope, key_header: str = RATE_LIMIT_KEY_HEADER, api_keys: frozenset = RATE_LIMIT_API_KEYS) -> str:
+    """
+    Who sent the request: its API key when it is one of `api_keys`, else its
+    IP. Also scopes Idempotency-Keys, so clients can't replay each other's
+    responses.
+    """
+    header = key_header.lower().encode()
+    for name, value in scope["headers"]:
+        if name == header and value.decode("latin-1") in api_keys:
+            return "key:" + value.decode("latin-1")
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class BucketStore(ABC):
+    @abstractmethod
+    async def take(self, buckets: list[tuple[str, float, int]]) -> float:
+        """
+        Takes one token from each (key, rate, burst) bucket if all of them
+        have one; returns 0 if allowed, else seconds until they all do.
+        """
+
+
+class InMemoryBucketStore(BucketStore):
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets = {}      # key -> [tokens, last refill]
+        self._lock = Lock()
+
+    async def take(self, buckets: list[tuple[str, float, int]]) -> float:
+        now = time.monotonic()
+        with self._lock:
+            refilled = [(self._refill(key, rate, burst, now), rate) for key, rate, burst in buckets]
+            wait = max(((1 - bucket[0]) / rate for bucket, rate in refilled if bucket[0] < 1), default=0.0)
+            if not wait:
+                for bucket, _ in refilled:
+                    bucket[0] -= 1
+            return wait
+
+    def _refill(self, key: str, rate: float, burst: int, now: float) -> list:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._evict_idle(now)
+            bucket = self._buckets[key] = [float(burst), now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def _evict_idle(self, now: float):
+        # Buckets idle for a minute are (nearly always) full again, so
+        # forgetting them changes nothing for the client.
+        idle = [key for key, (_, updated) in self._buckets.items() if now - updated > 60]
+        for key in idle or list(self._buckets)[: len(self._buckets) // 10]:
+            del self._buckets[key]
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, rules: list[RateRule], store: BucketStore | None = None,
+                 key_header: str = RATE_LIMIT_KEY_HEADER, api_keys: frozenset = RATE_LIMIT_API_KEYS):
+        self.app = app
+        self.rules = rules
+        self.store = store or InMemoryBucketStore()
+        self.key_header = key_header
+        self.api_keys = api_keys
+
+    def _client_key(self, scope) -> str:
+        return client_key(scope, self.key_header, self.api_keys)
+
+    async def _wait(self, scope, rule: RateRule) -> float:
+        buckets = [(f"{rule.name}|{self._client_key(scope)}", rule.rate, rule.burst)]
+        session = scope["path"][len(rule.path) + 1:].split("/", 1)[0] if rule.by_session else ""
+        if session:
+            buckets.append(
+                (f"{rule.name}|session:{session}", rule.session_rate or rule.rate, rule.session_burst or rule.burst)
+            )
+        return await self.store.take(buckets)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method, path = scope["method"], scope["path"]
+        for rule in self.rules:
+            if rule.matches(method, path):
+                break
+        else:
+            return await self.app(scope, receive, send)
+
+        wait = await self._wait(scope, rule)
+        if not wait:
+            return await self.app(scope, receive, send)
+
+        metrics.incr("rate_limited_total", rule=rule.name)
+        body = json.dumps({"detail": "Too many requests. Please slow down."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(wait)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,213 @@
+"""
+Shared pytest fixtures.
+
+`ollama_stub` starts a local HTTP server that mimics the parts of the
+Ollama API the app talks to (/api/chat, /api/generate, /api/ps, /api/tags)
+plus an OpenAI-compatible /v1/chat/completions. `ollama_stubs` is a factory
+for tests that need several servers. `test_db` points the app's get_db at a
+fresh in-memory SQLite database, and `stub_agent` makes /chat talk to the
+stub.
+"""
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+os.environ.setdefault("OLLAMA_WARMUP", "false")
+
+
+class OllamaStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, load_delay: float = 0.0, reply: str = "Hello from the stub"):
+        super().__init__(("127.0.0.1", 0), _OllamaHandler)
+        self.load_delay = load_delay
+        self.response_delay = 0.0
+        self.reply = reply
+        self.tool_calls = None
+        # Answer a tool result with the plain reply instead of calling again.
+        self.tool_calls_once = False
+        self.prompt_eval_duration = 1_000_000
+        self.loaded = set()
+        self.requests = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def unload(self, model: str | None = None):
+        with self._lock:
+            if model is None:
+                self.loaded.clear()
+            else:
+                self.loaded.discard(model)
+
+    def ensure_loaded(self, model: str) -> int:
+        with self._lock:
+            cold = model not in self.loaded
+            self.loaded.add(model)
+        if cold and self.load_delay:
+            time.sleep(self.load_delay)
+        return int(self.load_delay * 1e9) if cold else 0
+
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, body: dict, status: int = 200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        stub = self.server
+        if self.path == "/api/ps":
+            models = [{"name": m, "model": m} for m in sorted(stub.loaded)]
+            self._send_json({"models": models})
+        elif self.path == "/api/tags":
+            self._send_json({"models": []})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        stub = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        stub.requests.append((self.path, body))
+        model = body.get("model", "")
+
+        if self.path == "/api/generate":
+            load_duration = stub.ensure_loaded(model)
+            self._send_json({
+                "model": model,
+                "created_at": "2024-01-01T00:00:00Z",
+                "response": "",
+                "done": True,
+                "done_reason": "load",
+                "load_duration": load_duration,
+            })
+        elif self.path == "/api/chat":
+            load_duration = stub.ensure_loaded(model)
+            if stub.response_delay:
+                time.sleep(stub.response_delay)
+            message = {"role": "assistant", "content": stub.reply}
+            messages = body.get("messages") or [{}]
+            answered = stub.tool_calls_once and messages[-1].get("role") == "tool"
+            if stub.tool_calls and not answered:
+                message = {"role": "assistant", "content": "", "tool_calls": stub.tool_calls}
+            final = {
+                "model": model,
+                "created_at": "2024-01-01T00:00:00Z",
+                "message": message,
+                "done": True,
+                "done_reason": "stop",
+                "total_duration": load_duration + stub.prompt_eval_duration,
+                "load_duration": load_duration,
+                "prompt_eval_count": sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4,
+                "prompt_eval_duration": stub.prompt_eval_duration,
+                "eval_count": 1,
+                "eval_duration": 1_000_000,
+            }
+            if body.get("stream"):
+                data = (json.dumps(final) + "\n").encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self._send_json(final)
+        elif self.path == "/v1/chat/completions":
+            if stub.response_delay:
+                time.sleep(stub.response_delay)
+            self._send_json({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": stub.reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            })
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+
+@pytest.fixture
+def ollama_stubs():
+    started = []
+
+    def start(**kwargs) -> OllamaStub:
+        stub = OllamaStub(**kwargs)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        started.append(stub)
+        return stub
+
+    yield start
+    for stub in started:
+        stub.shutdown()
+        stub.server_close()
+
+
+@pytest.fixture
+def ollama_stub(ollama_stubs):
+    return ollama_stubs()
+
+
+@pytest.fixture
+def stub_agent(ollama_stub, test_db):
+    """Makes /chat use a ChatOllama pointed at the stub (and the test database)."""
+    from langchain_ollama import ChatOllama
+    from app.agents import langchain_agent
+
+    stub_llm = ChatOllama(model="llama3.1", base_url=ollama_stub.url, temperature=0)
+    real_create_agent = langchain_agent.create_agent_with_tools
+    with patch(
+        "app.routes.chat.create_agent_with_tools",
+        lambda tools: real_create_agent(tools, model=stub_llm),
+    ):
+        yield ollama_stub
+
+
+@pytest.fixture
+def test_db():
+    from app.main import app
+    from app.database import Base, get_db
+
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    TestingSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = TestingSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    previous = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = override_get_db
+    yield TestingSession
+    if previous is None:
+        app.dependency_overrides.pop(get_db, None)
+    else:
+        app.dependency_overrides[get_db] = previous
+    engine.dispose()
@@ -0,0 +1,30 @@
+"""indexes for the registration access patterns
+
+- created_at: list_registrations orders by it (newest first)
+- lower(email): case-insensitive lookups by email
+- phone: lookups by phone number
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_registrations_created_at", "registrations", ["created_at"])
+    op.create_index("ix_registrations_email_lower", "registrations", [sa.text("lower(email)")])
+    op.create_index("ix_registrations_phone", "registrations", ["phone"])
+
+
+def downgrade():
+    op.drop_index("ix_registrations_phone", table_name="registrations")
+    op.drop_index("ix_registrations_email_lower", table_name="registrations")
+    op.drop_index("ix_registrations_created_at", table_name="registrations")
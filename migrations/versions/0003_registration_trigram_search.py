@@ -0,0 +1,38 @@
+"""trigram indexes for registration search (PostgreSQL only)
+
+search_registrations matches name, email and phone with LIKE '%q%' and the
+pg_trgm similarity operator; GIN trigram indexes serve both. Other databases
+use the in-process n-gram index (app/services/search_index.py).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+"""
+
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    "ix_registrations_full_name_trgm": "lower(full_name)",
+    "ix_registrations_email_trgm": "lower(email)",
+    "ix_registrations_phone_trgm": "phone",
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, expression in INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON registrations USING gin ({expression} gin_trgm_ops)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    for name in INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
@@ -0,0 +1,37 @@
+"""append-only audit log of registration mutations
+
+Rows are written in batches by the event pipeline (app/services/events.py),
+never updated or deleted by the app.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "registration_events",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("action", sa.String(length=20), nullable=False),
+        sa.Column("registration_id", sa.String(length=36), nullable=False),
+        sa.Column("source", sa.String(length=20), nullable=False),
+        sa.Column("changes", sa.JSON(), nullable=True),
+        sa.Column("occurred_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_registration_events_registration_id", "registration_events", ["registration_id"])
+    op.create_index("ix_registration_events_occurred_at", "registration_events", ["occurred_at"])
+
+
+def downgrade():
+    op.drop_index("ix_registration_events_occurred_at", table_name="registration_events")
+    op.drop_index("ix_registration_events_registration_id", table_name="registration_events")
+    op.drop_table("registration_events")
@@ -0,0 +1,36 @@
+"""make lower(email) unique
+
+0002 indexed lower(email) for lookups only, so "Anu@gmail.com" and
+"anu@gmail.com" could both be registered. Existing duplicates must be
+merged or deleted before upgrading; the upgrade lists them and stops.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    duplicates = op.get_bind().execute(sa.text(
+        "SELECT lower(email) FROM registrations GROUP BY lower(email) HAVING count(*) > 1"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(
+            "Cannot make registrations.email case-insensitively unique; deduplicate these emails first: "
+            + ", ".join(duplicates)
+        )
+    op.drop_index("ix_registrations_email_lower", table_name="registrations")
+    op.create_index("ix_registrations_email_lower", "registrations", [sa.text("lower(email)")], unique=True)
+
+
+def downgrade():
+    op.drop_index("ix_registrations_email_lower", table_name="registrations")
+    op.create_index("ix_registrations_email_lower", "registrations", [sa.text("lower(email)")])
@@ -0,0 +1,156 @@
+import threading
+import time
+from datetime import date
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.schemas.registration import RegistrationCreate
+from app.services import reg_service
+from app.services.events import DatabaseEventSink, EventPipeline, FileEventSink, MutationEvent
+from app.tools.registration_tools import RegistrationTools
+from app.utils.metrics import metrics
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def pipeline(test_db):
+    pipeline = EventPipeline(DatabaseEventSink(test_db), flush_seconds=0.05)
+    pipeline.start()
+    with patch.object(reg_service, "event_pipeline", pipeline):
+        yield pipeline
+    pipeline.stop()
+
+
+def _logged(pipeline):
+    events = []
+    pipeline.replay(events.append)
+    return events
+
+
+def test_rest_and_chat_mutations_are_logged(pipeline, test_db):
+    user_id = client.post("/users/", json={
+        "full_name": "Audit Me", "email": "audit@example.com", "phone": "5550001234", "date_of_birth": "1990-01-01",
+    }).json()["id"]
+    client.put(f"/users/{user_id}", json={"address": "Hyderabad"})
+
+    db = test_db()
+    try:
+        RegistrationTools(db).delete(user_id)
+    finally:
+        db.close()
+    pipeline.stop()
+
+    events = _logged(pipeline)
+    assert [(e.action, e.source) for e in events] == [("created", "api"), ("updated", "api"), ("deleted", "chat")]
+    assert {e.registration_id for e in events} == {user_id}
+    assert events[0].changes["date_of_birth"] == "1990-01-01"
+    assert events[1].changes == {"address": "Hyderabad"}
+
+
+class _SlowSink:
+    def __init__(self):
+        self.release = threading.Event()
+        self.written = []
+
+    def write(self, events):
+        self.release.wait(5)
+        self.written.extend(events)
+
+
+def test_full_queue_applies_backpressure_without_losing_events():
+    sink = _SlowSink()
+    pipeline = EventPipeline(sink, max_queue=2, batch_size=1, flush_seconds=0.01, put_timeout=0.01)
+    pipeline.start()
+    before = metrics.snapshot()["counters"].get("audit_backpressure_total", 0)
+    threading.Timer(0.2, sink.release.set).start()
+
+    started = time.perf_counter()
+    for i in range(10):
+        pipeline.emit(MutationEvent("created", str(i), "api"))
+    # Once the queue is full, emit() waits for the sink instead of dropping.
+    assert time.perf_counter() - started >= 0.15
+    assert metrics.snapshot()["counters"]["audit_backpressure_total"] > before
+
+    pipeline.stop()
+    assert sorted(int(e.registration_id) for e in sink.written) == list(range(10))
+
+
+def test_stop_flushes_queued_events_and_notifies_subscribers(tmp_path):
+    sink = FileEventSink(tmp_path / "audit.jsonl")
+    pipeline = EventPipeline(sink, batch_size=100, flush_seconds=60)
+    batches = []
+    pipeline.subscribe(batches.append)
+    pipeline.start()
+
+    for i in range(5):
+        pipeline.emit(MutationEvent("updated", str(i), "chat", {"phone": "5551112222"}))
+    pipeline.stop()
+
+    assert sum(len(b) for b in batches) == 5
+    replayed = _logged(pipeline)
+    assert [e.registration_id for e in replayed] == ["0", "1", "2", "3", "4"]
+    assert replayed[0].changes == {"phone": "5551112222"}
+    assert pipeline.replay(lambda e: None, since=replayed[-1].occurred_at) >= 1
+
+
+class _FlakySink(FileEventSink):
+    def __init__(self, path):
+        super().__init__(path)
+        self.down = True
+
+    def write(self, events):
+        if self.down:
+            raise ConnectionError("audit database is down")
+        super().write(events)
+
+
+def test_rejected_batches_go_to_the_fallback_file_and_back(tmp_path):
+    sink = _FlakySink(tmp_path / "audit.jsonl")
+    fallback = FileEventSink(tmp_path / "fallback.jsonl")
+    pipeline = EventPipeline(sink, flush_seconds=0.01, fallback=fallback)
+    batches = []
+    pipeline.subscribe(batches.append)
+    dropped = metrics.snapshot()["counters"].get("audit_events_dropped_total{reason=write_failed}", 0)
+
+    pipeline._write([MutationEvent("created", "1", "api"), MutationEvent("updated", "1", "chat")])
+
+    assert [e.registration_id for e in fallback.read()] == ["1", "1"]
+    assert sum(len(b) for b in batches) == 2
+    assert metrics.snapshot()["counters"].get("audit_events_dropped_total{reason=write_failed}", 0) == dropped
+
+    sink.down = False
+    pipeline._write([MutationEvent("deleted", "1", "api")])
+
+    assert [e.action for e in sink.read()] == ["deleted", "created", "updated"]
+    assert not fallback.path.exists()
+
+
+def test_replay_includes_events_left_in_the_fallback_file(tmp_path):
+    fallback = FileEventSink(tmp_path / "fallback.jsonl")
+    fallback.write([MutationEvent("created", "7", "api")])
+    pipeline = EventPipeline(FileEventSink(tmp_path / "audit.jsonl"), fallback=fallback)
+
+    assert [e.registration_id for e in _logged(pipeline)] == ["7"]
+    assert not fallback.path.exists()
+
+
+def test_events_are_not_queued_without_a_running_pipeline(test_db):
+    pipeline = EventPipeline(DatabaseEventSink(test_db))
+    before = metrics.snapshot()["counters"].get("audit_events_dropped_total{reason=not_started}", 0)
+
+    db = test_db()
+    try:
+        with patch.object(reg_service, "event_pipeline", pipeline):
+            reg_service.create_registration(db, RegistrationCreate(
+                full_name="Nobody Listening", email="quiet@example.com", phone="5550009999",
+                date_of_birth=date(1990, 1, 1),
+            ))
+    finally:
+        db.close()
+
+    assert metrics.snapshot()["counters"]["audit_events_dropped_total{reason=not_started}"] == before + 1
+    assert _logged(pipeline) == []
@@ -0,0 +1,117 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.utils.idempotency import IdempotencyStore
+
+client = TestClient(app)
+
+BOB = {"full_name": "Bob Idem", "email": "bob.idem@gmail.com", "phone": "5557654321", "date_of_birth": "1985-02-03"}
+
+
+def test_retried_create_replays_the_stored_response(test_db):
+    headers = {"Idempotency-Key": "create-bob-1"}
+    first = client.post("/users/", json=BOB, headers=headers)
+    retry = client.post("/users/", json=BOB, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert len(client.get("/users/").json()) == 1
+
+    # Without a key the duplicate is still rejected.
+    assert client.post("/users/", json=BOB).status_code == 400
+
+
+def test_key_reused_for_another_body_is_rejected(test_db):
+    headers = {"Idempotency-Key": "create-bob-2"}
+    client.post("/users/", json=BOB, headers=headers)
+
+    response = client.post("/users/", json={**BOB, "email": "other@gmail.com"}, headers=headers)
+    assert response.status_code == 422
+
+
+def test_same_key_from_another_client_is_not_replayed(test_db):
+    headers = {"Idempotency-Key": "create-1"}
+    first = client.post("/users/", json=BOB, headers=headers)
+    other_ip = TestClient(app, client=("10.0.0.2", 50000))
+    other = other_ip.post("/users/", json={**BOB, "email": "carol.idem@gmail.com"}, headers=headers)
+
+    assert first.status_code == other.status_code == 200
+    assert "Idempotent-Replayed" not in other.headers
+    assert other.json()["email"] == "carol.idem@gmail.com"
+    assert len(client.get("/users/").json()) == 2
+
+
+def test_concurrent_chat_retries_run_the_agent_once(stub_agent):
+    stub_agent.response_delay = 0.3
+    headers = {"Idempotency-Key": "turn-1"}
+
+    def send(_):
+        return client.post("/chat/idem_session", json={"message": "Hello"}, headers=headers)
+
+    with ThreadPoolExecutor(2) as pool:
+        responses = list(pool.map(send, range(2)))
+
+    assert [r.json() for r in responses] == [{"reply": stub_agent.reply}] * 2
+    assert sorted(r.headers.get("Idempotent-Replayed", "") for r in responses) == ["", "true"]
+    assert len([p for p, _ in stub_agent.requests if p == "/api/chat"]) == 1
+
+
+def test_in_flight_duplicates_wait_for_the_first_request():
+    store = IdempotencyStore()
+    calls = []
+
+    def handle(_):
+        replay = store.begin("k", "fp")
+        if replay is not None:
+            return replay.body
+        calls.append(1)
+        time.sleep(0.1)
+        store.finish("k", {"n": len(calls)})
+        return {"n": len(calls)}
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(handle, range(4)))
+
+    assert calls == [1]
+    assert results == [{"n": 1}] * 4
+
+
+def test_failures_release_the_key_and_4xx_are_stored():
+    store = IdempotencyStore()
+
+    store.begin("k", "fp")
+    store.finish("k", error=RuntimeError("db down"))
+    assert store.begin("k", "fp") is None
+
+    store.finish("k", {"reply": "partial"}, final=False)
+    assert store.begin("k", "fp") is None
+
+    store.finish("k", error=HTTPException(status_code=400, detail="Email already registered"))
+    replay = store.begin("k", "fp")
+    assert (replay.status_code, replay.body) == (400, {"detail": "Email already registered"})
+
+
+def test_keys_expire_after_the_ttl():
+    store = IdempotencyStore(ttl_seconds=0.05)
+    store.begin("k", "fp")
+    store.finish("k", {"ok": True})
+    assert store.begin("k", "fp") is not None
+
+    time.sleep(0.06)
+    assert store.begin("k", "other-fp") is None
+
+
+def test_waiting_gives_up_with_409():
+    store = IdempotencyStore()
+    store.begin("k", "fp")
+
+    with pytest.raises(HTTPException) as exc:
+        store.begin("k", "fp", wait_seconds=0.05)
+    assert exc.value.status_code == 409
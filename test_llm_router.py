@@ -0,0 +1,171 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.tools import StructuredTool
+
+from app.main import app
+from app.agents import langchain_agent
+from app.agents.llm_router import LIGHT_TIER, LLMRouter, RoutedChatModel, make_backend
+from app.agents.warmup import ModelWarmer
+from app.utils.metrics import metrics
+
+client = TestClient(app)
+
+
+def _ollama(stub, name, timeout=5, tier="default", model="llama3.1"):
+    return make_backend(
+        {"name": name, "model": model, "base_url": stub.url, "timeout": timeout, "tier": tier}
+    )
+
+
+def _lookup_tool():
+    def get_registration(identifier: str) -> str:
+        """Looks a user up by email or ID."""
+        return "{}"
+    return StructuredTool.from_function(get_registration)
+
+
+def test_picks_backend_with_lowest_expected_wait(ollama_stubs):
+    fast, slow = ollama_stubs(reply="fast"), ollama_stubs(reply="slow")
+    b_fast, b_slow = _ollama(fast, "fast"), _ollama(slow, "slow")
+    b_fast.ewma_latency, b_slow.ewma_latency = 0.1, 0.5
+    router = LLMRouter([b_slow, b_fast])
+    model = RoutedChatModel(router=router)
+
+    assert model.invoke([HumanMessage("hi")]).content == "fast"
+
+    # A queue on the fast backend makes the idle one the better choice.
+    b_fast.in_flight = 9
+    assert router.candidates()[0] is b_slow
+
+
+def test_fails_over_on_timeout(ollama_stubs):
+    hung, healthy = ollama_stubs(reply="late"), ollama_stubs(reply="on time")
+    hung.response_delay = 2
+    b_hung, b_ok = _ollama(hung, "hung", timeout=0.2), _ollama(healthy, "healthy")
+    b_hung.ewma_latency, b_ok.ewma_latency = 0.01, 1.0
+    router = LLMRouter([b_hung, b_ok])
+    failovers = metrics.snapshot()["counters"].get("llm_failovers_total{tier=default}", 0)
+
+    message = RoutedChatModel(router=router).invoke([HumanMessage("hi")])
+
+    assert message.content == "on time"
+    assert message.response_metadata["backend"] == "healthy"
+    assert b_hung.failures == 1
+    assert router.candidates()[-1] is b_hung
+    assert metrics.snapshot()["counters"]["llm_failovers_total{tier=default}"] == failovers + 1
+
+
+def test_fails_over_to_openai_compatible_endpoint(ollama_stubs):
+    down = ollama_stubs()
+    down.shutdown()
+    down.server_close()
+    openai_stub = ollama_stubs(reply="from openai")
+    b_down = _ollama(down, "down", timeout=1)
+    b_openai = make_backend(
+        {"name": "openai", "provider": "openai", "model": "gpt-4o-mini", "base_url": f"{openai_stub.url}/v1"}
+    )
+    b_openai.ewma_latency = 5.0
+
+    message = RoutedChatModel(router=LLMRouter([b_down, b_openai])).invoke([HumanMessage("hi")])
+
+    assert message.content == "from openai"
+    assert openai_stub.requests[-1][0] == "/v1/chat/completions"
+
+
+def test_only_tool_free_calls_after_a_tool_result_go_to_light_model(ollama_stubs):
+    big, small = ollama_stubs(reply="big"), ollama_stubs(reply="small")
+    router = LLMRouter([_ollama(big, "big"), _ollama(small, "small", tier=LIGHT_TIER, model="llama3.2:1b")])
+    model = RoutedChatModel(router=router)
+
+    assert model.invoke([HumanMessage("register Alice")]).content == "big"
+
+    after_tool = [
+        HumanMessage("get alice@test.com"),
+        AIMessage("", tool_calls=[{"name": "get_registration", "args": {"identifier": "alice@test.com"}, "id": "1"}]),
+        ToolMessage('{"full_name": "Alice"}', tool_call_id="1"),
+    ]
+    assert model.invoke(after_tool).content == "small"
+    assert small.requests[-1][1]["model"] == "llama3.2:1b"
+
+    # With tools bound the next step may be another tool call (e.g. the
+    # update after a lookup), which the light model must not make.
+    with_tools = model.bind_tools([_lookup_tool()])
+    assert with_tools.invoke(after_tool).content == "big"
+    assert "tools" in big.requests[-1][1]
+
+
+def test_tool_calls_never_fail_over_to_light_model(ollama_stubs):
+    big, small = ollama_stubs(reply="big"), ollama_stubs(reply="small")
+    b_big = _ollama(big, "big")
+    b_big.cooldown_until = float("inf")
+    router = LLMRouter([b_big, _ollama(small, "small", tier=LIGHT_TIER, model="llama3.2:1b")])
+    model = RoutedChatModel(router=router).bind_tools([_lookup_tool()])
+
+    assert model.invoke([HumanMessage("get alice@test.com")]).content == "big"
+    assert small.requests == []
+
+
+def _update_call(identifier):
+    return [{"function": {"name": "update_registration", "arguments": {"user_id": identifier, "address": "Pune"}}}]
+
+
+def test_chat_confirms_successful_writes_on_light_model(ollama_stubs, test_db):
+    big, small = ollama_stubs(reply="big"), ollama_stubs(reply="small")
+    big.tool_calls_once = True
+    routed = RoutedChatModel(
+        router=LLMRouter([_ollama(big, "big"), _ollama(small, "small", tier=LIGHT_TIER, model="llama3.2:1b")])
+    )
+    real_create_agent = langchain_agent.create_agent_with_tools
+    client.post("/users/", json={
+        "full_name": "Alice Turner", "email": "alice.turner@gmail.com", "phone": "5551239876",
+        "date_of_birth": "1990-05-01", "address": "",
+    })
+
+    with patch(
+        "app.routes.chat.create_agent_with_tools",
+        lambda tools: real_create_agent(tools, model=routed),
+    ):
+        big.tool_calls = _update_call("alice.turner@gmail.com")
+        assert client.post("/chat/light_ok_session", json={"message": "Alice moved"}).json()["reply"] == "small"
+        _, body = small.requests[-1]
+        assert not body.get("tools")
+        assert json.loads(body["messages"][-1]["content"])["status"] == "ok"
+
+        # A failed write may need another tool call, so it stays on the default tier.
+        big.tool_calls = _update_call("nobody@test.com")
+        assert client.post("/chat/light_error_session", json={"message": "Bob moved"}).json()["reply"] == "big"
+        assert len(small.requests) == 1
+
+
+def test_warmers_use_each_backends_options(ollama_stubs):
+    stub = ollama_stubs()
+    backend = make_backend(
+        {"name": "gpu", "model": "llama3.1", "base_url": stub.url, "keep_alive": "2h", "num_ctx": 4096},
+        {"keep_alive": "30m", "num_ctx": 8192},
+    )
+    warmer = ModelWarmer.for_backend(backend)
+
+    assert asyncio.run(warmer.warm())
+    _, body = stub.requests[-1]
+    assert body["keep_alive"] == "2h"
+    assert body["options"]["num_ctx"] == 4096
+
+
+def test_chat_endpoint_routes_with_tools_bound(ollama_stubs):
+    stub = ollama_stubs(reply="routed reply")
+    routed = RoutedChatModel(router=LLMRouter([_ollama(stub, "only")]))
+    real_create_agent = langchain_agent.create_agent_with_tools
+
+    with patch(
+        "app.routes.chat.create_agent_with_tools",
+        lambda tools: real_create_agent(tools, model=routed),
+    ):
+        response = client.post("/chat/router_session", json={"message": "Hi"})
+
+    assert response.json()["reply"] == "routed reply"
+    tool_names = [t["function"]["name"] for t in stub.requests[-1][1]["tools"]]
+    assert "create_registration" in tool_names
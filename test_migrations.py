@@ -0,0 +1,152 @@
+"""
+Builds the schema with the Alembic migrations and checks with
+EXPLAIN QUERY PLAN that every reg_service query is served by an index.
+"""
+
+from datetime import date
+
+import json
+
+import pytest
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from app.database import run_migrations
+from app.models.registration import Registration
+from app.schemas.registration import RegistrationCreate
+from app.services import reg_service
+from app.tools.registration_tools import RegistrationTools
+
+
+@pytest.fixture
+def migrated_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrated.db'}")
+    run_migrations(engine)
+    yield engine
+    engine.dispose()
+
+
+def _capture_selects(engine, fn):
+    statements = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_execute)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_execute)
+    return statements
+
+
+def _plan(engine, statement, parameters) -> list[str]:
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def test_migrations_create_the_model_schema(migrated_engine):
+    inspector = inspect(migrated_engine)
+    with migrated_engine.connect() as conn:
+        # The inspector skips expression indexes on SQLite, so read the catalog.
+        migrated = set(conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'registrations'"
+        )).scalars())
+    declared = {ix.name for ix in Registration.__table__.indexes}
+    assert declared <= migrated
+    assert {c["name"] for c in inspector.get_columns("registrations")} == set(Registration.__table__.columns.keys())
+
+
+def test_create_all_databases_are_adopted(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Registration.__table__.create(bind=engine)
+    with engine.begin() as conn:
+        for index in Registration.__table__.indexes:
+            conn.execute(text(f"DROP INDEX {index.name}"))
+
+    run_migrations(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT version_num FROM alembic_version")).scalar() == "0005"
+
+
+def test_reg_service_queries_use_indexes(migrated_engine):
+    db = sessionmaker(bind=migrated_engine)()
+    created = reg_service.create_registration(db, RegistrationCreate(
+        full_name="Anu Rao",
+        email="Anu@gmail.com",
+        phone="9989898989",
+        date_of_birth=date(1990, 1, 1),
+    ))
+
+    queries = {
+        "get_registration": lambda: reg_service.get_registration(db, created.id),
+        "get_registration_by_email": lambda: reg_service.get_registration_by_email(db, "anu@GMAIL.com"),
+        "find_registrations_by_phone": lambda: reg_service.find_registrations_by_phone(db, "9989898989"),
+        "list_registrations": lambda: reg_service.list_registrations(db),
+    }
+    for name, query in queries.items():
+        db.expire_all()
+        statements = _capture_selects(migrated_engine, query)
+        assert statements, name
+        for statement, parameters in statements:
+            plan = _plan(migrated_engine, statement, parameters)
+            table_steps = [step for step in plan if "registrations" in step]
+            assert table_steps, (name, plan)
+            for step in table_steps:
+                assert "USING" in step and "INDEX" in step, (name, plan)
+            assert not any("TEMP B-TREE" in step for step in plan), (name, plan)
+
+    assert reg_service.get_registration_by_email(db, "ANU@gmail.com").id == created.id
+    db.close()
+
+
+def _register(db, full_name, email, phone="9989898989"):
+    return reg_service.create_registration(db, RegistrationCreate(
+        full_name=full_name, email=email, phone=phone, date_of_birth=date(1990, 1, 1),
+    ))
+
+
+def test_emails_are_unique_regardless_of_case(migrated_engine):
+    db = sessionmaker(bind=migrated_engine)()
+    _register(db, "Anu Rao", "Anu@gmail.com")
+    with pytest.raises(IntegrityError):
+        _register(db, "Anu Rao", "anu@gmail.com")
+    db.close()
+
+
+def test_upgrade_lists_emails_that_differ_only_in_case(tmp_path):
+    from alembic import command
+    from alembic.config import Config
+    from app.database import PROJECT_ROOT
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'dupes.db'}")
+    cfg = Config(str(PROJECT_ROOT / "alembic.ini"))
+    cfg.set_main_option("script_location", str(PROJECT_ROOT / "migrations"))
+    cfg.attributes["configure_logger"] = False
+    with engine.begin() as conn:
+        cfg.attributes["connection"] = conn
+        command.upgrade(cfg, "0004")
+    db = sessionmaker(bind=engine)()
+    _register(db, "Anu Rao", "Anu@gmail.com")
+    _register(db, "Anu Rao", "anu@gmail.com")
+    db.close()
+
+    with pytest.raises(RuntimeError, match="anu@gmail.com"):
+        run_migrations(engine)
+    engine.dispose()
+
+
+def test_shared_phone_numbers_are_not_resolved(migrated_engine):
+    db = sessionmaker(bind=migrated_engine)()
+    _register(db, "Anu Rao", "anu@gmail.com")
+    _register(db, "Ravi Rao", "ravi@gmail.com")
+    tools = RegistrationTools(db)
+
+    assert "More than one user" in json.loads(tools.get("998-989-8989"))["error"]
+    assert "More than one user" in json.loads(tools.delete("9989898989"))["error"]
+    assert len(reg_service.list_registrations(db)) == 2
+    assert json.loads(tools.get("anu@gmail.com"))["full_name"] == "Anu Rao"
+    db.close()
@@ -0,0 +1,69 @@
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from langchain_ollama import ChatOllama
+
+from app.main import app
+from app.agents import langchain_agent
+from app.agents.langchain_agent import OLLAMA_NUM_CTX, get_system_prompt
+from app.utils.metrics import metrics
+
+client = TestClient(app)
+
+
+def test_static_prefix_is_identical_across_turns_and_sessions(ollama_stub):
+    stub_llm = ChatOllama(
+        model="llama3.1",
+        base_url=ollama_stub.url,
+        keep_alive="30m",
+        num_ctx=OLLAMA_NUM_CTX,
+        temperature=0,
+    )
+    real_create_agent = langchain_agent.create_agent_with_tools
+
+    with patch(
+        "app.routes.chat.create_agent_with_tools",
+        lambda tools: real_create_agent(tools, model=stub_llm),
+    ):
+        for session_id, message in [("prefix_a", "Hi"), ("prefix_a", "Still there?"), ("prefix_b", "Hello")]:
+            response = client.post(f"/chat/{session_id}", json={"message": message})
+            assert response.status_code == 200
+            assert response.json()["reply"] == ollama_stub.reply
+
+    chat_requests = [body for path, body in ollama_stub.requests if path == "/api/chat"]
+    assert len(chat_requests) == 3
+
+    first = chat_requests[0]
+    assert first["messages"][0] == {"role": "system", "content": get_system_prompt()}
+    for body in chat_requests[1:]:
+        assert body["messages"][0] == first["messages"][0]
+        assert body["tools"] == first["tools"]
+        assert body["options"] == first["options"]
+    assert first["options"]["num_ctx"] == OLLAMA_NUM_CTX
+    assert first["keep_alive"] == "30m"
+
+
+def test_prompt_eval_time_recorded_per_turn(ollama_stub):
+    stub_llm = ChatOllama(model="llama3.1", base_url=ollama_stub.url, temperature=0)
+    real_create_agent = langchain_agent.create_agent_with_tools
+    key = f"prompt_eval_seconds{{variant={langchain_agent.PROMPT_VARIANT}}}"
+    before = metrics.snapshot()["summaries"].get(key, {}).get("count", 0)
+
+    ollama_stub.prompt_eval_duration = 250_000_000
+    with patch(
+        "app.routes.chat.create_agent_with_tools",
+        lambda tools: real_create_agent(tools, model=stub_llm),
+    ):
+        client.post("/chat/prompt_eval_session", json={"message": "Hi"})
+
+    summary = metrics.snapshot()["summaries"][key]
+    assert summary["count"] == before + 1
+    assert summary["max"] >= 0.25
+
+
+def test_compact_prompt_keeps_the_rules():
+    compact = get_system_prompt("compact")
+    assert len(compact) < len(get_system_prompt("full")) / 2
+    for field in ["full_name", "email", "phone", "date_of_birth", "address", "TELL THE USER:"]:
+        assert field in compact
+    assert get_system_prompt("unknown") == get_system_prompt("full")
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.main import app as main_app
+from app.utils.rate_limit import BucketStore, InMemoryBucketStore, RateLimitMiddleware, parse_rules
+
+
+def _client(rules, **options):
+    app = FastAPI()
+
+    @app.post("/chat/{session_id}")
+    def chat(session_id: str):
+        return {"session": session_id}
+
+    @app.get("/users/{user_id}")
+    def get_user(user_id: str):
+        return {"id": user_id}
+
+    @app.get("/health/ready")
+    def ready():
+        return {"ready": True}
+
+    app.add_middleware(RateLimitMiddleware, rules=parse_rules(json.dumps(rules)), **options)
+    return TestClient(app)
+
+
+def test_burst_then_429_with_retry_after():
+    client = _client([{"path": "/users", "methods": ["GET"], "rate": 0.1, "burst": 2}], api_keys=frozenset({"partner"}))
+
+    assert [client.get("/users/1").status_code for _ in range(3)] == [200, 200, 429]
+    limited = client.get("/users/1")
+    assert limited.status_code == 429
+    assert 1 <= int(limited.headers["Retry-After"]) <= 10
+
+    # Made-up keys don't get a fresh bucket; known keys have their own.
+    assert client.get("/users/1", headers={"X-API-Key": "made-up"}).status_code == 429
+    assert client.get("/users/1", headers={"X-API-Key": "partner"}).status_code == 200
+    assert all(client.get("/health/ready").status_code == 200 for _ in range(5))
+
+
+def test_chat_is_limited_per_session_and_refills():
+    client = _client([{"path": "/chat", "methods": ["POST"], "rate": 20, "burst": 3,
+                       "by_session": True, "session_rate": 20, "session_burst": 1}])
+
+    assert client.post("/chat/a").status_code == 200
+    assert client.post("/chat/a").status_code == 429
+    assert client.post("/chat/b").status_code == 200
+
+    time.sleep(0.1)
+    assert client.post("/chat/a").status_code == 200
+
+
+def test_refused_requests_cost_no_tokens():
+    client = _client([{"path": "/chat", "methods": ["POST"], "rate": 0.1, "burst": 2,
+                       "by_session": True, "session_rate": 0.1, "session_burst": 1}])
+
+    # The session bucket refuses the retries; the client's bucket keeps its token.
+    assert [client.post("/chat/a").status_code for _ in range(3)] == [200, 429, 429]
+    assert client.post("/chat/b").status_code == 200
+    assert client.post("/chat/c").status_code == 429
+
+
+def test_new_sessions_do_not_escape_the_client_limit():
+    client = _client([{"path": "/chat", "methods": ["POST"], "rate": 0.1, "burst": 3, "by_session": True}])
+
+    assert [client.post(f"/chat/s{i}").status_code for i in range(5)] == [200, 200, 200, 429, 429]
+
+
+def test_rules_need_a_positive_rate_and_burst():
+    for bad in [{"rate": 0}, {"rate": -1}, {"rate": 1, "burst": 0}, {"rate": 1, "session_rate": 0}]:
+        with pytest.raises(ValueError):
+            parse_rules(json.dumps([{"path": "/users", **bad}]))
+    with pytest.raises(TypeError):
+        BucketStore()
+
+
+def test_most_specific_rule_wins():
+    rules = parse_rules(json.dumps([
+        {"path": "/users", "rate": 1},
+        {"path": "/users/search", "methods": ["get"], "rate": 10, "burst": 5},
+    ]))
+
+    matched = next(r for r in rules if r.matches("GET", "/users/search"))
+    assert (matched.path, matched.burst, matched.methods) == ("/users/search", 5, frozenset({"GET"}))
+    assert next(r for r in rules if r.matches("DELETE", "/users/1")).path == "/users"
+    assert not any(r.matches("GET", "/usersearch") for r in rules)
+
+
+def test_bucket_store_is_cheap_and_bounded():
+    store = InMemoryBucketStore(max_keys=1_000)
+
+    async def take_many():
+        for i in range(20_000):
+            await store.take([(f"ip:{i % 2_000}", 100, 100)])
+
+    start = time.perf_counter()
+    asyncio.run(take_many())
+    per_call = (time.perf_counter() - start) / 20_000
+
+    assert per_call < 50e-6
+    assert len(store._buckets) <= 1_000
+
+
+def test_app_installs_the_limiter():
+    assert any(m.cls is RateLimitMiddleware for m in main_app.user_middleware)
@@ -0,0 +1,142 @@
+import asyncio
+import time
+from functools import partial
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.messages import HumanMessage
+
+from app.main import app
+from app.agents import langchain_agent
+from app.agents.llm_router import LLMBackend, LLMRouter, RoutedChatModel, make_backend
+from app.agents.run_budget import BudgetExceeded, RunBudget, run_agent
+from app.routes.chat import PARTIAL_REPLY
+from app.utils.metrics import metrics
+
+client = TestClient(app)
+
+LOOKUP_CALL = [{"function": {"name": "get_registration", "arguments": {"identifier": "nobody@test.com"}}}]
+
+
+def _exhausted(reason):
+    return metrics.snapshot()["counters"].get(f"agent_budget_exhausted_total{{reason={reason}}}", 0)
+
+
+def test_step_budget_stops_tool_loop_and_keeps_history_consistent(stub_agent):
+    stub_agent.tool_calls = LOOKUP_CALL
+    before = _exhausted("steps")
+
+    with patch("app.routes.chat.RunBudget", partial(RunBudget, max_steps=2, max_tool_calls=10)):
+        response = client.post("/chat/loop_session", json={"message": "Find nobody@test.com"})
+
+    assert response.json() == {"reply": PARTIAL_REPLY, "partial": True}
+    assert _exhausted("steps") == before + 1
+    assert len([p for p, _ in stub_agent.requests if p == "/api/chat"]) == 2
+
+    stub_agent.tool_calls = None
+    response = client.post("/chat/loop_session", json={"message": "Never mind"})
+    assert response.json()["reply"] == stub_agent.reply
+    roles = [m["role"] for m in stub_agent.requests[-1][1]["messages"]]
+    assert roles[-3:] == ["tool", "assistant", "user"]
+
+
+def test_routed_model_counts_each_call_once(ollama_stub, test_db):
+    router = LLMRouter([make_backend({"name": "stub", "model": "llama3.1", "base_url": ollama_stub.url})])
+    routed = RoutedChatModel(router=router)
+    real_create_agent = langchain_agent.create_agent_with_tools
+    ollama_stub.tool_calls = LOOKUP_CALL
+    budgets = []
+
+    def budget(**kwargs):
+        budgets.append(RunBudget(max_steps=2, max_tool_calls=10))
+        return budgets[-1]
+
+    with patch("app.routes.chat.create_agent_with_tools", lambda tools: real_create_agent(tools, model=routed)), \
+            patch("app.routes.chat.RunBudget", budget):
+        response = client.post("/chat/routed_budget_session", json={"message": "Find nobody@test.com"})
+
+    assert response.json()["partial"] is True
+    assert len([p for p, _ in ollama_stub.requests if p == "/api/chat"]) == 2
+    assert budgets[0].steps == 3
+    backend = router.backends[0]
+    assert (backend.failures, backend.cooldown_until, backend.in_flight) == (0, 0.0, 0)
+
+
+class _StoppedBackendModel:
+    def invoke(self, messages, **kwargs):
+        raise BudgetExceeded("deadline")
+
+
+def test_router_does_not_blame_backends_for_a_stopped_run():
+    backend = LLMBackend("stopped", _StoppedBackendModel())
+    routed = RoutedChatModel(router=LLMRouter([backend, LLMBackend("spare", _StoppedBackendModel())]))
+
+    with pytest.raises(BudgetExceeded):
+        routed._generate([HumanMessage(content="hi")])
+
+    assert (backend.failures, backend.cooldown_until, backend.in_flight) == (0, 0.0, 0)
+
+
+def test_tool_call_budget(stub_agent):
+    stub_agent.tool_calls = LOOKUP_CALL
+    before = _exhausted("tool_calls")
+
+    with patch("app.routes.chat.RunBudget", partial(RunBudget, max_steps=10, max_tool_calls=1)):
+        response = client.post("/chat/tool_budget_session", json={"message": "Find nobody@test.com"})
+
+    assert response.json()["partial"] is True
+    assert _exhausted("tool_calls") == before + 1
+
+
+def test_deadline_returns_partial_reply(stub_agent):
+    stub_agent.tool_calls = LOOKUP_CALL
+    stub_agent.response_delay = 0.3
+    before = _exhausted("deadline")
+
+    with patch("app.routes.chat.RunBudget", partial(RunBudget, deadline_seconds=0.1)):
+        response = client.post("/chat/deadline_session", json={"message": "Find nobody@test.com"})
+
+    assert response.json() == {"reply": PARTIAL_REPLY, "partial": True}
+    assert _exhausted("deadline") == before + 1
+    assert len([p for p, _ in stub_agent.requests if p == "/api/chat"]) == 1
+
+
+def test_abandoned_turn_is_repaired_before_the_next_turn_runs(stub_agent):
+    stub_agent.tool_calls = LOOKUP_CALL
+    stub_agent.response_delay = 0.6
+
+    with patch("app.routes.chat.RunBudget", partial(RunBudget, deadline_seconds=0.1)), \
+            patch("app.routes.chat.run_agent", partial(run_agent, grace_seconds=0.1)):
+        response = client.post("/chat/abandoned_session", json={"message": "Find nobody@test.com"})
+    # The request gave up while the worker is still waiting on the model.
+    assert response.json() == {"reply": PARTIAL_REPLY, "partial": True}
+
+    stub_agent.tool_calls = None
+    stub_agent.response_delay = 0
+    response = client.post("/chat/abandoned_session", json={"message": "Never mind"})
+    assert response.json()["reply"] == stub_agent.reply
+    roles = [m["role"] for m in stub_agent.requests[-1][1]["messages"]]
+    assert roles[-3:] == ["tool", "assistant", "user"]
+
+
+class _DisconnectedRequest:
+    async def is_disconnected(self):
+        return True
+
+
+def test_client_disconnect_cancels_run():
+    budget = RunBudget()
+    steps = []
+
+    def loop():
+        while True:
+            budget.check()
+            steps.append(1)
+            time.sleep(0.01)
+
+    with pytest.raises(BudgetExceeded) as exc:
+        asyncio.run(run_agent(loop, budget, _DisconnectedRequest(), grace_seconds=1))
+
+    assert exc.value.reason == "disconnected"
+    assert budget.cancelled
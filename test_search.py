@@ -0,0 +1,172 @@
+import json
+import os
+import random
+import statistics
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.search_index import RegistrationSearchIndex
+from app.tools.registration_tools import RegistrationTools
+
+client = TestClient(app)
+
+USERS = [
+    ("Alice Smith", "alice.smith@example.com", "5551234567"),
+    ("Alicia Keys", "akeys@example.com", "5559876543"),
+    ("Bob Alison", "bob@builder.org", "5550001111"),
+    ("Carol Smithers", "carol@example.net", "5552223333"),
+]
+
+
+def _create_users():
+    ids = {}
+    for name, email, phone in USERS:
+        response = client.post("/users/", json={
+            "full_name": name, "email": email, "phone": phone, "date_of_birth": "1990-01-01",
+        })
+        ids[name] = response.json()["id"]
+    return ids
+
+
+def _names(query, **params):
+    response = client.get("/users/search", params={"q": query, **params})
+    assert response.status_code == 200
+    return [user["full_name"] for user in response.json()]
+
+
+def test_search_ranks_exact_then_prefix_then_substring(test_db):
+    _create_users()
+
+    assert _names("alice smith")[0] == "Alice Smith"
+    assert _names("ALICE.SMITH@example.com") == ["Alice Smith"]
+    assert _names("smith") == ["Alice Smith", "Carol Smithers"]
+    assert _names("ali")[:2] == ["Alice Smith", "Alicia Keys"]
+    assert "Bob Alison" in _names("ali")
+    assert _names("555-987") == ["Alicia Keys"]
+    assert _names("ali", limit=1) == ["Alice Smith"]
+    assert _names("zzzz") == []
+
+
+def test_search_tolerates_typos(test_db):
+    _create_users()
+
+    assert _names("Alise Smith")[0] == "Alice Smith"
+
+
+def test_search_follows_updates_and_deletes(test_db):
+    ids = _create_users()
+    assert _names("smithers") == ["Carol Smithers"]
+
+    client.put(f"/users/{ids['Carol Smithers']}", json={"full_name": "Carol Jones"})
+    assert "Carol Jones" not in _names("smithers")
+    assert _names("jones") == ["Carol Jones"]
+
+    client.delete(f"/users/{ids['Carol Smithers']}")
+    assert _names("jones") == []
+
+
+def test_search_tool_returns_matches(test_db):
+    _create_users()
+    db = test_db()
+    try:
+        result = json.loads(RegistrationTools(db).search("Alice Smith"))
+        assert result["matches"][0]["email"] == "alice.smith@example.com"
+        assert "error" in json.loads(RegistrationTools(db).search("nobody at all"))
+    finally:
+        db.close()
+
+
+def test_index_prefers_shorter_fields_among_equal_matches():
+    index = RegistrationSearchIndex()
+    long_id, short_id = uuid.uuid4(), uuid.uuid4()
+    index.load([
+        (long_id, "Annabelle Fitzgerald-Montgomery", "annabelle@example.com", "5550000001"),
+        (short_id, "Anna Lee", "anna@example.com", "5550000002"),
+    ])
+
+    assert [reg_id for reg_id, _ in index.search("ann")] == [short_id, long_id]
+    index.remove(short_id)
+    assert [reg_id for reg_id, _ in index.search("ann")] == [long_id]
+
+
+def test_writes_during_a_load_are_not_blocked_and_survive_the_swap():
+    index = RegistrationSearchIndex()
+    kept, removed, added = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    halfway, resume = threading.Event(), threading.Event()
+
+    def rows():
+        yield kept, "Kept Person", "kept@example.com", "5550000001"
+        yield removed, "Removed Person", "removed@example.com", "5550000002"
+        halfway.set()
+        resume.wait(5)
+
+    loader = threading.Thread(target=index.load, args=(rows(),))
+    loader.start()
+    assert halfway.wait(5)
+
+    started = time.perf_counter()
+    index.upsert(added, "Added Person", "added@example.com", "5550000003")
+    index.remove(removed)
+    assert time.perf_counter() - started < 0.5
+    resume.set()
+    loader.join(5)
+
+    assert index.loaded
+    assert {reg_id for reg_id, _ in index.search("person")} == {kept, added}
+
+
+FIRST_NAMES = (
+    "alice bob carol david emma frank grace henry isla jack kate liam mia noah olivia peter quinn ruby "
+    "sam tara uma victor wendy xavier yara zoe anna ben chloe dan ella finn george hannah ivan julia"
+).split()
+LAST_NAMES = (
+    "jones brown taylor wilson davies evans thomas johnson roberts walker wright robinson thompson white "
+    "hughes edwards green hall wood harris lewis martin jackson clarke turner hill scott cooper rao patel"
+).split()
+
+
+# Opt-in: building the index takes about a minute per million rows.
+BENCHMARK_ROWS = int(os.getenv("SEARCH_BENCHMARK_ROWS", "0"))
+
+
+def _synthetic_rows(count):
+    rng = random.Random(7)
+    for i in range(count):
+        first = rng.choice(FIRST_NAMES)
+        # 15% are Smiths, so their grams have postings of 30k+ docs.
+        last = "smith" if rng.random() < 0.15 else rng.choice(LAST_NAMES)
+        yield (
+            uuid.UUID(int=rng.getrandbits(128)), f"{first.title()} {last.title()}",
+            f"{first}.{last}{i}@example.com", str(rng.randrange(10**9, 10**10)),
+        )
+
+
+def _best_ms(index, query, runs=5):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        index.search(query)
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+@pytest.mark.skipif(not BENCHMARK_ROWS, reason="set SEARCH_BENCHMARK_ROWS (e.g. 1000000) to run")
+def test_search_benchmark():
+    index = RegistrationSearchIndex()
+    index.load(_synthetic_rows(BENCHMARK_ROWS))
+
+    # The fuzzy tier still finds typos when their trigrams are very common.
+    assert index._docs[index._doc_ids[index.search("Alise Smith")[0][0]]][1][0] == "alice smith"
+
+    misses = ["Jonathon Smyth", "Bartholomew", "zzzz", "qwerty uiop", "dwardswatsonxall", "nobody@nowhere.org"]
+    assert all(index.search(query) == [] for query in misses)
+    timings = [_best_ms(index, query) for query in misses]
+    assert statistics.median(timings) < 10, timings
+    # The worst case is a miss made of one common name's trigrams: about
+    # 40 ms at a million rows.
+    assert max(timings) < 50, timings
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.agents import sessions
+from app.agents.langchain_agent import memory
+
+client = TestClient(app)
+
+
+def _chat(session_id, message):
+    return client.post(f"/chat/{session_id}", json={"message": message}).json()
+
+
+def _listed(session_id):
+    return next((s for s in client.get("/chat/sessions").json() if s["session_id"] == session_id), None)
+
+
+def test_list_and_inspect_a_session(stub_agent):
+    _chat("lifecycle_session", "Hi")
+    _chat("lifecycle_session", "Hi again")
+
+    listed = _listed("lifecycle_session")
+    assert listed["turns"] == 2
+    assert listed["checkpoints"] > 0 and listed["size_bytes"] > 0
+    assert listed["idle_seconds"] is not None
+
+    detail = client.get("/chat/sessions/lifecycle_session").json()
+    assert [m["role"] for m in detail["transcript"]] == ["user", "assistant", "user", "assistant"]
+    assert detail["transcript"][-1]["content"] == stub_agent.reply
+
+
+def test_reset_forgets_the_conversation(stub_agent):
+    _chat("reset_session", "Remember me")
+
+    assert client.post("/chat/sessions/reset_session/reset").status_code == 200
+    assert client.get("/chat/sessions/reset_session").json()["transcript"] == []
+    assert _listed("reset_session")["turns"] == 0
+
+    _chat("reset_session", "Who am I?")
+    roles = [m["role"] for m in stub_agent.requests[-1][1]["messages"]]
+    assert roles == ["system", "user"]
+
+
+def test_delete_frees_the_session(stub_agent):
+    _chat("doomed_session", "Hi")
+
+    assert client.delete("/chat/sessions/doomed_session").status_code == 200
+    assert "doomed_session" not in memory.storage
+    assert _listed("doomed_session") is None
+    assert client.get("/chat/sessions/doomed_session").status_code == 404
+    assert client.delete("/chat/sessions/doomed_session").status_code == 404
+    assert client.post("/chat/sessions/doomed_session/reset").status_code == 404
+
+
+def test_reaper_expires_idle_sessions_only(stub_agent):
+    _chat("idle_session", "Hi")
+    _chat("busy_session", "Hi")
+    long_ago = datetime.utcnow() - timedelta(hours=2)
+    sessions.SESSIONS["idle_session"]["last_activity"] = long_ago
+    sessions.SESSIONS["busy_session"]["last_activity"] = long_ago
+    sessions.SESSIONS["busy_session"]["active"] = 1
+
+    reaper = sessions.SessionReaper(ttl_seconds=3600, interval_seconds=0.01)
+
+    async def run_once():
+        reaper.start()
+        await asyncio.sleep(0.05)
+        await reaper.stop()
+
+    asyncio.run(run_once())
+
+    assert "idle_session" not in sessions.SESSIONS
+    assert "idle_session" not in memory.storage
+    assert "busy_session" in sessions.SESSIONS
+    sessions.SESSIONS["busy_session"]["active"] = 0
+
+
+def test_busy_sessions_are_not_deleted_or_reset(stub_agent):
+    _chat("in_flight_session", "Hi")
+    sessions.SESSIONS["in_flight_session"]["active"] = 1
+    try:
+        for response in (client.delete("/chat/sessions/in_flight_session"),
+                         client.post("/chat/sessions/in_flight_session/reset")):
+            assert response.status_code == 409
+            assert response.headers["Retry-After"]
+        assert len(client.get("/chat/sessions/in_flight_session").json()["transcript"]) == 2
+    finally:
+        sessions.SESSIONS["in_flight_session"]["active"] = 0
+
+    assert client.delete("/chat/sessions/in_flight_session").status_code == 200
+
+
+def test_reaper_sweeps_threads_without_a_session(stub_agent):
+    _chat("orphaned_session", "Hi")
+    # e.g. a turn that was still writing when its session was dropped
+    del sessions.SESSIONS["orphaned_session"]
+
+    assert "orphaned_session" not in sessions.reap_idle_sessions(ttl_seconds=3600)
+    assert "orphaned_session" in memory.storage
+
+    assert "orphaned_session" in sessions.reap_idle_sessions(ttl_seconds=0)
+    assert "orphaned_session" not in memory.storage
+    assert _listed("orphaned_session") is None
+
+
+def test_orphans_that_got_a_session_are_kept(stub_agent):
+    _chat("revived_session", "Hi")
+    # Collected as an orphan before the lock; a turn registered it since.
+    with patch.object(sessions, "_orphaned_threads", lambda now, ttl: ["revived_session"]):
+        assert sessions.reap_idle_sessions(ttl_seconds=3600) == []
+    assert "revived_session" in memory.storage
+
+
+def test_reaper_does_not_block_the_event_loop():
+    reaper = sessions.SessionReaper(ttl_seconds=3600, interval_seconds=0.01)
+    locked, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with sessions._lock:
+            locked.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    locked.wait(5)
+
+    async def tick_while_reaping():
+        reaper.start()
+        started = time.perf_counter()
+        await asyncio.sleep(0.2)
+        elapsed = time.perf_counter() - started
+        release.set()
+        await reaper.stop()
+        return elapsed
+
+    try:
+        assert asyncio.run(tick_while_reaping()) < 1
+    finally:
+        release.set()
+        holder.join()
@@ -0,0 +1,167 @@
+import json
+from functools import partial
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.agents.run_budget import RunBudget
+from app.models.registration import Registration
+from app.services import reg_service
+from app.services.events import EventPipeline
+from app.tools.registration_tools import TURN_ROLLED_BACK, RegistrationTools
+from app.utils.metrics import metrics
+
+client = TestClient(app)
+
+ALICE = {
+    "full_name": "Alice Turner", "email": "alice.turner@gmail.com", "phone": "5551239876",
+    "date_of_birth": "1990-05-01", "address": "",
+}
+CREATE_CALL = [{"function": {"name": "create_registration", "arguments": ALICE}}]
+
+
+class _RecordingPipeline(EventPipeline):
+    def __init__(self):
+        super().__init__(sink=None)
+        self.emitted = []
+
+    def emit(self, event):
+        self.emitted.append(event)
+
+
+@pytest.fixture
+def events():
+    pipeline = _RecordingPipeline()
+    with patch.object(reg_service, "event_pipeline", pipeline):
+        yield pipeline.emitted
+
+
+def _emails(session_factory):
+    db = session_factory()
+    try:
+        return [r.email for r in db.query(Registration)]
+    finally:
+        db.close()
+
+
+def test_turn_writes_share_one_transaction(test_db, events):
+    db = test_db()
+    tools = RegistrationTools(db, unit_of_work=True)
+
+    created = json.loads(tools.create(ALICE))
+    tools.update({"id": created["id"], "updates": {"address": "Pune"}})
+    assert json.loads(tools.get("alice.turner@gmail.com"))["address"] == "Pune"
+    assert db.info.get("commits", 0) == 0 and events == []
+
+    db.commit()
+    assert db.info["commits"] == 1
+    assert _emails(test_db) == ["alice.turner@gmail.com"]
+    assert [e.action for e in events] == ["created", "updated"]
+    db.close()
+
+
+def test_rollback_discards_writes_and_their_events(test_db, events):
+    db = test_db()
+    tools = RegistrationTools(db, unit_of_work=True)
+
+    tools.create(ALICE)
+    db.rollback()
+
+    assert _emails(test_db) == [] and events == []
+    db.close()
+
+
+DUPLICATE_ALICE = {**ALICE, "full_name": "Alice Again", "phone": "5551110000"}
+
+
+def test_failed_write_fails_the_whole_turn(test_db, events):
+    db = test_db()
+    tools = RegistrationTools(db, unit_of_work=True)
+
+    tools.create(ALICE)
+    assert not tools.rollback_turn
+    duplicate = json.loads(tools.create(DUPLICATE_ALICE))
+    assert "already exists" in duplicate["error"]
+    assert duplicate["note"] == TURN_ROLLED_BACK
+    assert tools.rollback_turn
+
+    refused = json.loads(tools.create({**ALICE, "email": "second@gmail.com"}))
+    assert refused == {"error": TURN_ROLLED_BACK}
+    db.rollback()
+
+    assert _emails(test_db) == [] and events == []
+    db.close()
+
+
+def test_non_atomic_turn_keeps_the_other_writes(test_db, events):
+    db = test_db()
+    tools = RegistrationTools(db, unit_of_work=True, atomic=False)
+
+    tools.create(ALICE)
+    duplicate = json.loads(tools.create(DUPLICATE_ALICE))
+    assert "already exists" in duplicate["error"] and "note" not in duplicate
+    tools.create({**ALICE, "email": "second@gmail.com"})
+    assert not tools.rollback_turn
+    db.commit()
+
+    assert sorted(_emails(test_db)) == ["alice.turner@gmail.com", "second@gmail.com"]
+    db.close()
+
+
+def _commits():
+    return metrics.snapshot()["summaries"].get("chat_turn_commits", {"count": 0, "sum": 0})
+
+
+def test_chat_turn_commits_once(stub_agent):
+    stub_agent.tool_calls = CREATE_CALL
+    stub_agent.tool_calls_once = True
+    before = _commits()
+
+    response = client.post("/chat/uow_session", json={"message": "Register Alice Turner"})
+
+    assert response.json() == {"reply": stub_agent.reply}
+    assert client.get("/users/").json()[0]["email"] == "alice.turner@gmail.com"
+    after = _commits()
+    assert (after["count"] - before["count"], after["sum"] - before["sum"]) == (1, 1)
+
+
+def test_chat_turn_with_a_failed_write_rolls_back(stub_agent):
+    client.post("/users/", json=ALICE)
+    stub_agent.tool_calls = [{"function": {"name": "create_registration", "arguments": DUPLICATE_ALICE}}]
+    stub_agent.tool_calls_once = True
+    before = metrics.snapshot()["counters"].get("chat_turns_rolled_back_total{reason=write_failed}", 0)
+
+    response = client.post("/chat/uow_failed_session", json={"message": "Register Alice again"})
+
+    assert response.json() == {"reply": stub_agent.reply}
+    tool_result = json.loads(stub_agent.requests[-1][1]["messages"][-1]["content"])
+    assert tool_result["note"] == TURN_ROLLED_BACK
+    assert [u["full_name"] for u in client.get("/users/").json()] == ["Alice Turner"]
+    assert metrics.snapshot()["counters"]["chat_turns_rolled_back_total{reason=write_failed}"] == before + 1
+
+
+def test_interrupted_chat_turn_rolls_back(stub_agent):
+    stub_agent.tool_calls = CREATE_CALL
+
+    with patch("app.routes.chat.RunBudget", partial(RunBudget, max_steps=1)):
+        response = client.post("/chat/uow_partial_session", json={"message": "Register Alice Turner"})
+
+    assert response.json()["partial"] is True
+    assert client.get("/users/").json() == []
+
+
+def test_chat_turn_updates_an_existing_user(stub_agent):
+    client.post("/users/", json={k: v for k, v in ALICE.items() if k != "address"})
+    stub_agent.tool_calls = [{"function": {"name": "update_registration", "arguments": {
+        "user_id": "alice.turner@gmail.com", "address": "Pune",
+    }}}]
+    stub_agent.tool_calls_once = True
+
+    response = client.post("/chat/uow_update_session", json={"message": "Alice moved to Pune"})
+
+    assert response.json() == {"reply": stub_agent.reply}
+    assert client.get("/users/").json()[0]["address"] == "Pune"
+    tool_result = json.loads(stub_agent.requests[-1][1]["messages"][-1]["content"])
+    assert tool_result["status"] == "ok"
@@ -0,0 +1,84 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.agents.langchain_agent import SYSTEM_PROMPT
+from app.agents.warmup import ModelWarmer
+from app.utils.metrics import metrics
+
+client = TestClient(app)
+
+
+def test_warm_loads_model_with_system_prompt(ollama_stub):
+    ollama_stub.load_delay = 0.05
+    warmer = ModelWarmer(base_url=ollama_stub.url, model="llama3.1", keep_alive="10m")
+
+    assert asyncio.run(warmer.warm())
+
+    assert warmer.ready and warmer.model_loaded
+    assert "llama3.1" in ollama_stub.loaded
+    path, body = ollama_stub.requests[-1]
+    assert path == "/api/chat"
+    assert body["messages"][0] == {"role": "system", "content": SYSTEM_PROMPT}
+    assert body["keep_alive"] == "10m"
+    load = metrics.snapshot()["summaries"]["model_load_seconds{model=llama3.1}"]
+    assert load["max"] >= 0.05
+
+
+def test_heartbeat_refreshes_keep_alive_and_reloads(ollama_stub):
+    warmer = ModelWarmer(base_url=ollama_stub.url, model="llama3.1")
+    asyncio.run(warmer.warm())
+    before = metrics.snapshot()["counters"].get("model_reloads_total{model=llama3.1}", 0)
+
+    asyncio.run(warmer.heartbeat_once())
+    assert ollama_stub.requests[-1][0] == "/api/generate"
+
+    ollama_stub.unload()
+    asyncio.run(warmer.heartbeat_once())
+    assert ollama_stub.requests[-1][0] == "/api/chat"
+    assert "llama3.1" in ollama_stub.loaded
+    after = metrics.snapshot()["counters"]["model_reloads_total{model=llama3.1}"]
+    assert after == before + 1
+
+
+def test_chat_not_ready_until_model_loaded():
+    warmer = ModelWarmer(base_url="http://127.0.0.1:9", model="llama3.1")
+    warmer.started = True
+
+    with patch("app.routes.chat.model_warmer", warmer), \
+         patch("app.routes.health.model_warmer", warmer), \
+         patch("app.routes.chat.create_agent_with_tools") as mock_create_agent:
+        mock_agent = MagicMock()
+        mock_agent.invoke.return_value = {"messages": [MagicMock(content="Hi", tool_calls=None)]}
+        mock_create_agent.return_value = mock_agent
+
+        response = client.post("/chat/warmup_session", json={"message": "Hello"})
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+        assert client.get("/health/ready").status_code == 503
+        mock_agent.invoke.assert_not_called()
+
+        warmer.ready = True
+        response = client.post("/chat/warmup_session", json={"message": "Hello"})
+        assert response.status_code == 200
+        assert client.get("/health/ready").status_code == 200
+
+
+def test_cold_and_warm_latency_reported_separately(stub_agent):
+    summaries = lambda: metrics.snapshot()["summaries"]
+    cold_before = summaries().get("chat_turn_seconds{phase=cold}", {}).get("count", 0)
+    warm_before = summaries().get("chat_turn_seconds{phase=warm}", {}).get("count", 0)
+    stub_agent.load_delay = 0.1
+
+    # Each turn is classified by Ollama's load_duration, not by what the
+    # warmer believes: the model can be unloaded behind its back.
+    with patch("app.routes.chat.COLD_LOAD_SECONDS", 0.05):
+        client.post("/chat/latency_session", json={"message": "Hello"})
+        client.post("/chat/latency_session", json={"message": "Hello again"})
+        stub_agent.loaded.clear()
+        client.post("/chat/latency_session", json={"message": "Still there?"})
+
+    assert summaries()["chat_turn_seconds{phase=cold}"]["count"] == cold_before + 2
+    assert summaries()["chat_turn_seconds{phase=warm}"]["count"] == warm_before + 1